@@ -1,9 +1,27 @@
-from textblob import TextBlob
+import argparse
 import json
 import os
-from datetime import datetime
-from tqdm import tqdm
-from collections import defaultdict
+import re
+import time
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+from sentiment_backends import BACKENDS, get_scorer
+from sentiment_cache import SentimentCache, DEFAULT_CACHE_PATH
+from sentiment_store import save_sentiment_store
+from score_table import ScoreTableWriter
+from instrumentation import add_trace_arguments, finish_tracing, start_tracing, tracer
+from json_stream import IngestStats, iter_json_array
+from message_store import DEFAULT_STORE_PATH, FILE_TYPE_FILTERS, MessageStore, load_channel_table
+from rollup import DEFAULT_ROLLUP_PATH, RollupBuilder, RollupIndex
+from rolling import ROLLING_PERIODS, rolling_path, rolling_results
+from breakdown import BREAKDOWNS, DEFAULT_TOP, breakdown_path, build_breakdown, print_ranking
+from sketches import SentimentSketches, quantiles_path, sketch_path
+from time_index import iter_messages_between
+from timestamps import parse_timestamp, parse_timestamps, period_codes, period_labels
+
+DEFAULT_OUTPUT_DIR = 'data/sentiment'
 
 def load_json_file(filepath):
     with open(filepath, 'r', encoding='utf-8') as f:
@@ -16,156 +34,350 @@ def save_json_file(filepath, data):
         json.dump(data, f, indent=2, ensure_ascii=False)
 
 def get_time_period(timestamp, period='day'):
-    date = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-    if period == 'day':
-        return date.strftime('%Y-%m-%d')
-    elif period == 'month':
-        return date.strftime('%Y-%m')
-    elif period == 'year':
-        return date.strftime('%Y')
-    elif period == 'weekday':
-        return date.strftime('%A')  # Full weekday name
-    elif period == 'hour':
-        return date.strftime('%H')  # 24-hour format
-    elif period == 'day_hour':  # New period type
+    code = period_codes([parse_timestamp(timestamp)], period)
+    return period_labels(code, period)[0]
+
+def score_texts(texts, backend='textblob'):
+    # Module level so worker processes can pickle it
+    return get_scorer(backend).score_batch(texts)
+
+def score_texts_parallel(pool, texts, chunk_size, progress, backend='textblob'):
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    chunk_scores = [None] * len(chunks)
+    
+    futures = {pool.submit(score_texts, chunk, backend): index for index, chunk in enumerate(chunks)}
+    for future in as_completed(futures):
+        index = futures[future]
+        chunk_scores[index] = future.result()
+        progress.update(len(chunks[index]))
+    
+    # Reassemble in chunk order so the output does not depend on scheduling
+    return (np.concatenate([polarity for polarity, _ in chunk_scores]),
+            np.concatenate([subjectivity for _, subjectivity in chunk_scores]))
+
+MEMO_ENTRIES = 100000  # About 20 MB of short texts, memory stays bounded on mostly unique corpora
+
+class ScoreMemo:
+    """Scores of the most recently used distinct texts, so repeats like "lol" are scored once"""
+
+    def __init__(self, max_entries=MEMO_ENTRIES):
+        self.scores = OrderedDict()  # text -> (polarity, subjectivity), least recently used first
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.repeats = 0
+        self.scored = 0
+        self.evictions = 0
+        self.score_seconds = 0
+
+    def get(self, text):
+        scores = self.scores.get(text)
+        if scores is not None:
+            self.scores.move_to_end(text)
+        return scores
+
+    def update(self, scores):
+        for text, text_scores in scores.items():
+            self.scores[text] = text_scores
+            self.scores.move_to_end(text)
+        self.scored += len(scores)
+        while len(self.scores) > self.max_entries:
+            self.scores.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        scored = self.scored
+        seconds_per_text = self.score_seconds / scored if scored > 0 else 0
         return {
-            'weekday': date.strftime('%A'),
-            'hour': date.strftime('%H')
+            'texts': self.lookups,
+            'unique': scored,
+            'dedup_ratio': self.repeats / self.lookups if self.lookups > 0 else 0,
+            'evictions': self.evictions,
+            'score_seconds': self.score_seconds,
+            'seconds_saved': self.repeats * seconds_per_text
         }
-    return date.strftime('%Y-%m-%d')
-
-def analyze_messages(messages, period='day'):
-    # Overall statistics
-    overall_stats = {
-        'message_count': len(messages),
-        'positive_count': 0,
-        'negative_count': 0,
-        'neutral_count': 0,
-        'total_sentiment_count': 0,
-        'average_polarity': 0,
-        'average_subjectivity': 0
-    }
-    
-    # Modified time series structure for day_hour period
-    if period == 'day_hour':
-        time_series = defaultdict(lambda: defaultdict(lambda: {
-            'message_count': 0,
-            'positive_count': 0,
-            'negative_count': 0,
-            'neutral_count': 0,
-            'total_sentiment_count': 0,
-            'total_polarity': 0,
-            'total_subjectivity': 0,
-            'messages': []
-        }))
-    else:
-        time_series = defaultdict(lambda: {
-            'message_count': 0,
-            'positive_count': 0,
-            'negative_count': 0,
-            'neutral_count': 0,
-            'total_sentiment_count': 0,
-            'total_polarity': 0,
-            'total_subjectivity': 0,
-            'messages': []
-        })
-    
-    print("Analyzing messages...")
-    for message in tqdm(messages):
-        if not message['Contents']:  # Skip empty messages
-            continue
+
+def score_batch(messages, cache, pool, chunk_size, progress, backend='textblob', memo=None):
+    # Empty messages are counted but not scored, they keep NaN scores
+    polarity = np.full(len(messages), np.nan)
+    subjectivity = np.full(len(messages), np.nan)
+    if memo is None:
+        memo = ScoreMemo()
+    
+    # Look up cached scores first, then texts already scored in this run,
+    # only the remaining distinct texts need the scorer
+    missing = []
+    pending = {}  # text -> indices of the messages waiting for its score
+    with tracer.stage('cache_lookup', messages=len(messages)):
+        for index, message in enumerate(messages):
+            text = message['Contents']
+            if not text:
+                continue
+            cached = cache.get(message) if cache is not None else None
+            if cached is not None:
+                polarity[index], subjectivity[index] = cached
+                continue
+            
+            missing.append(index)
+            memo.lookups += 1
+            remembered = memo.get(text)
+            if remembered is not None:
+                # Filled in now, a later eviction cannot take it away before the batch is done
+                memo.repeats += 1
+                polarity[index], subjectivity[index] = remembered
+            elif text in pending:
+                memo.repeats += 1
+                pending[text].append(index)
+            else:
+                pending[text] = [index]
+    waiting = sum(len(indices) for indices in pending.values())
+    progress.update(len(messages) - waiting)
+    
+    texts = list(pending)
+    tracer.count('texts_scored', len(texts))
+    started = time.perf_counter()
+    with tracer.stage('score_texts', texts=len(texts), backend=backend):
+        if pool is not None and len(texts) > chunk_size:
+            new_polarity, new_subjectivity = score_texts_parallel(pool, texts, chunk_size, progress, backend)
+        else:
+            new_polarity, new_subjectivity = score_texts(texts, backend)
+            progress.update(len(texts))
+    memo.score_seconds += time.perf_counter() - started
+    progress.update(waiting - len(texts))
+    
+    with tracer.stage('cache_write', messages=len(missing)):
+        new_scores = dict(zip(texts, zip(new_polarity.tolist(), new_subjectivity.tolist())))
+        memo.update(new_scores)
+        for text, indices in pending.items():
+            polarity[indices], subjectivity[indices] = new_scores[text]
+        if cache is not None:
+            for index in missing:
+                cache.put(messages[index], float(polarity[index]), float(subjectivity[index]))
+    
+    return polarity, subjectivity
+
+def iter_score_batches(messages, cache=None, workers=1, chunk_size=2000, backend='textblob', memo=None):
+    # Yields (messages, polarity, subjectivity) batches in input order, one batch in memory at a time
+    if memo is None:
+        memo = ScoreMemo()
+    batch_size = chunk_size * max(workers, 1) * 4
+    total = len(messages) if hasattr(messages, '__len__') else None
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    messages = iter(messages)
+    
+    from tqdm import tqdm  # Only the scoring pass shows progress
+    print("Scoring messages...")
+    try:
+        with tqdm(total=total) as progress:
+            while True:
+                # Reading the batch is where the JSON parsing (or store scan) happens
+                with tracer.stage('read_batch'):
+                    batch = list(islice(messages, batch_size))
+                if not batch:
+                    break
+                tracer.count('messages', len(batch))
+                
+                polarity, subjectivity = score_batch(batch, cache, pool, chunk_size, progress, backend, memo)
+                yield batch, polarity, subjectivity
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if cache is not None:
+            cache.flush()
+
+class PeriodBuckets:
+    """Per-bucket sums for one period, grouped by integer period code"""
+
+    def __init__(self, period):
+        self.period = period
+        self.slots = {}  # period code -> row in the arrays below, in order of first appearance
+        self.codes = []
+        self.counts = np.zeros((0, 3), dtype=np.int64)  # positive, negative, neutral
+        self.totals = np.zeros((0, 2))  # polarity, subjectivity
+
+    def add_batch(self, epochs, polarity, subjectivity):
+        codes = period_codes(epochs, self.period)
+        unique, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
         
-        # Perform sentiment analysis
-        analysis = TextBlob(message['Contents'])
-        polarity = analysis.sentiment.polarity
-        subjectivity = analysis.sentiment.subjectivity
+        # New buckets get slots in order of first appearance, like dict insertion did
+        unique_slots = np.empty(len(unique), dtype=np.int64)
+        for index in np.argsort(first, kind='stable').tolist():
+            code = int(unique[index])
+            slot = self.slots.get(code)
+            if slot is None:
+                slot = self.slots[code] = len(self.codes)
+                self.codes.append(code)
+            unique_slots[index] = slot
+        slots = unique_slots[inverse.ravel()]
         
-        # Get time period
-        time_key = get_time_period(message['Timestamp'], period)
+        bucket_count = len(self.codes)
+        if bucket_count > len(self.counts):
+            grow = bucket_count - len(self.counts)
+            self.counts = np.vstack([self.counts, np.zeros((grow, 3), dtype=np.int64)])
+            self.totals = np.vstack([self.totals, np.zeros((grow, 2))])
         
-        # Update overall statistics
-        if polarity > 0:
-            overall_stats['positive_count'] += 1
-            overall_stats['total_sentiment_count'] += 1
-        elif polarity < 0:
-            overall_stats['negative_count'] += 1
-            overall_stats['total_sentiment_count'] -= 1
-        else:
-            overall_stats['neutral_count'] += 1
+        positive = polarity > 0
+        negative = polarity < 0
+        neutral = ~(positive | negative)
+        self.counts[:, 0] += np.bincount(slots[positive], minlength=bucket_count)
+        self.counts[:, 1] += np.bincount(slots[negative], minlength=bucket_count)
+        self.counts[:, 2] += np.bincount(slots[neutral], minlength=bucket_count)
         
-        # Update time series data
-        if period == 'day_hour':
-            weekday = time_key['weekday']
-            hour = time_key['hour']
-            period_data = time_series[weekday][hour]
-        else:
-            period_data = time_series[time_key]
-            
-        period_data['message_count'] += 1
-        period_data['total_polarity'] += polarity
-        period_data['total_subjectivity'] += subjectivity
+        # np.add.at adds in message order, so the float sums match a plain loop exactly
+        np.add.at(self.totals[:, 0], slots, polarity)
+        np.add.at(self.totals[:, 1], slots, subjectivity)
+
+    def summation_order(self):
+        # Order the old nested dicts were summed in: slots by first appearance,
+        # and for day_hour grouped by the weekday's first appearance
+        if self.period != 'day_hour':
+            return list(range(len(self.codes)))
+        weekday_rank = {}
+        for code in self.codes:
+            weekday_rank.setdefault(code // 24, len(weekday_rank))
+        return sorted(range(len(self.codes)), key=lambda slot: weekday_rank[self.codes[slot] // 24])
+
+    def to_state(self):
+        return {
+            'codes': self.codes,
+            'counts': self.counts.tolist(),
+            'totals': self.totals.tolist()
+        }
+
+    @classmethod
+    def from_state(cls, period, state):
+        buckets = cls(period)
+        buckets.codes = list(state['codes'])
+        buckets.slots = {code: slot for slot, code in enumerate(buckets.codes)}
+        buckets.counts = np.array(state['counts'], dtype=np.int64).reshape(-1, 3)
+        buckets.totals = np.array(state['totals'], dtype=np.float64).reshape(-1, 2)
+        return buckets
+
+class SentimentAggregator:
+    """Running sums for several periods at once, memory grows with the number of buckets only"""
+
+    def __init__(self, periods):
+        self.periods = list(periods)
+        self.message_count = 0
+        self.overall_counts = np.zeros(3, dtype=np.int64)  # positive, negative, neutral
+        self.buckets = {period: PeriodBuckets(period) for period in self.periods}
         
-        if polarity > 0:
-            period_data['positive_count'] += 1
-            period_data['total_sentiment_count'] += 1
-        elif polarity < 0:
-            period_data['negative_count'] += 1
-            period_data['total_sentiment_count'] -= 1
-        else:
-            period_data['neutral_count'] += 1
+        # Newest timestamp seen and the message IDs at exactly that second
+        self.high_water_epoch = None
+        self.high_water_ids = set()
+
+    def track_high_water(self, messages, epochs):
+        if len(epochs) == 0:
+            return
+        newest = int(np.max(epochs))
+        if self.high_water_epoch is None or newest > self.high_water_epoch:
+            self.high_water_epoch = newest
+            self.high_water_ids = set()
+        if newest == self.high_water_epoch:
+            for index in np.flatnonzero(np.asarray(epochs) == newest).tolist():
+                self.high_water_ids.add(str(messages[index]['ID']))
+
+    def to_state(self, scorer_version):
+        # Raw running sums, floats survive the JSON round trip exactly
+        return {
+            'scorer_version': scorer_version,
+            'periods': self.periods,
+            'message_count': self.message_count,
+            'overall_counts': self.overall_counts.tolist(),
+            'high_water_epoch': self.high_water_epoch,
+            'high_water_ids': sorted(self.high_water_ids),
+            'buckets': {period: buckets.to_state() for period, buckets in self.buckets.items()}
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        aggregator = cls(state['periods'])
+        aggregator.message_count = state['message_count']
+        aggregator.overall_counts = np.array(state['overall_counts'], dtype=np.int64)
+        aggregator.high_water_epoch = state['high_water_epoch']
+        aggregator.high_water_ids = set(state['high_water_ids'])
+        aggregator.buckets = {period: PeriodBuckets.from_state(period, buckets)
+                              for period, buckets in state['buckets'].items()}
+        return aggregator
+
+    def iter_new_messages(self, messages, batch_size=65536):
+        # Skip everything up to the high-water mark, assumes exports only ever append messages
+        if self.high_water_epoch is None:
+            yield from messages
+            return
         
-        # Store message with sentiment
-        message_with_sentiment = message.copy()
-        message_with_sentiment.update({
-            'polarity': polarity,
-            'subjectivity': subjectivity
-        })
-        period_data['messages'].append(message_with_sentiment)
-    
-    # Calculate averages for overall stats
-    msg_count = overall_stats['message_count']
-    if period == 'day_hour':
-        total_polarity = sum(data['total_polarity'] 
-                           for weekday in time_series.values() 
-                           for data in weekday.values())
-        total_subjectivity = sum(data['total_subjectivity'] 
-                               for weekday in time_series.values() 
-                               for data in weekday.values())
-    else:
-        total_polarity = sum(data['total_polarity'] for data in time_series.values())
-        total_subjectivity = sum(data['total_subjectivity'] for data in time_series.values())
-    
-    overall_stats['average_polarity'] = total_polarity / msg_count if msg_count > 0 else 0
-    overall_stats['average_subjectivity'] = total_subjectivity / msg_count if msg_count > 0 else 0
-    
-    # Convert time series to sorted list and calculate averages
-    time_series_list = []
-    if period == 'day_hour':
-        weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        hours = [f"{h:02d}" for h in range(24)]
+        messages = iter(messages)
+        while True:
+            batch = list(islice(messages, batch_size))
+            if not batch:
+                return
+            epochs = parse_timestamps(message['Timestamp'] for message in batch).tolist()
+            for message, epoch in zip(batch, epochs):
+                if epoch > self.high_water_epoch or \
+                   (epoch == self.high_water_epoch and str(message['ID']) not in self.high_water_ids):
+                    yield message
+
+    def add_batch(self, epochs, polarity, subjectivity):
+        # Messages with NaN scores were empty, they only count towards message_count
+        self.message_count += len(polarity)
+        scored = ~np.isnan(polarity)
+        epochs = np.asarray(epochs, dtype=np.int64)[scored]
+        polarity = polarity[scored]
+        subjectivity = subjectivity[scored]
+        
+        self.overall_counts += [(polarity > 0).sum(), (polarity < 0).sum(), (polarity == 0).sum()]
+        for buckets in self.buckets.values():
+            buckets.add_batch(epochs, polarity, subjectivity)
+
+    def results(self, period):
+        buckets = self.buckets[period]
+        positive, negative, neutral = self.overall_counts.tolist()
         
-        for weekday in weekdays:
-            for hour in hours:
-                if weekday in time_series and hour in time_series[weekday]:
-                    data = time_series[weekday][hour]
-                    period_count = data['message_count']
-                    if period_count > 0:
-                        time_series_list.append({
-                            'weekday': weekday,
-                            'hour': hour,
-                            'message_count': period_count,
-                            'positive_count': data['positive_count'],
-                            'negative_count': data['negative_count'],
-                            'neutral_count': data['neutral_count'],
-                            'total_sentiment_count': data['total_sentiment_count'],
-                            'average_polarity': data['total_polarity'] / period_count,
-                            'average_subjectivity': data['total_subjectivity'] / period_count
-                        })
+        overall_stats = {
+            'message_count': self.message_count,
+            'positive_count': positive,
+            'negative_count': negative,
+            'neutral_count': neutral,
+            'total_sentiment_count': positive - negative,
+            'average_polarity': 0,
+            'average_subjectivity': 0
+        }
+        
+        # Calculate averages for overall stats
+        msg_count = overall_stats['message_count']
+        order = buckets.summation_order()
+        total_polarity = sum(buckets.totals[order, 0].tolist())
+        total_subjectivity = sum(buckets.totals[order, 1].tolist())
+        
+        overall_stats['average_polarity'] = total_polarity / msg_count if msg_count > 0 else 0
+        overall_stats['average_subjectivity'] = total_subjectivity / msg_count if msg_count > 0 else 0
+        
+        # Convert time series to sorted list and calculate averages
+        rows = {}
+        labels = period_labels(buckets.codes, period)
+        for slot, (label, code) in enumerate(zip(labels, buckets.codes)):
+            period_positive, period_negative, period_neutral = buckets.counts[slot].tolist()
+            period_polarity, period_subjectivity = buckets.totals[slot].tolist()
+            period_count = period_positive + period_negative + period_neutral
+            rows[code] = (label, {
+                'message_count': period_count,
+                'positive_count': period_positive,
+                'negative_count': period_negative,
+                'neutral_count': period_neutral,
+                'total_sentiment_count': period_positive - period_negative,
+                'average_polarity': period_polarity / period_count,
+                'average_subjectivity': period_subjectivity / period_count
+            })
+        
+        time_series_list = []
+        if period == 'day_hour':
+            # Every weekday/hour slot is listed, missing ones as empty data
+            for code in range(7 * 24):
+                label = period_labels([code], period)[0]
+                if code in rows:
+                    time_series_list.append({**label, **rows[code][1]})
                 else:
-                    # Add empty data for missing time slots
                     time_series_list.append({
-                        'weekday': weekday,
-                        'hour': hour,
+                        **label,
                         'message_count': 0,
                         'positive_count': 0,
                         'negative_count': 0,
@@ -174,51 +386,319 @@ def analyze_messages(messages, period='day'):
                         'average_polarity': 0,
                         'average_subjectivity': 0
                     })
-    else:
-        for date, data in sorted(time_series.items()):
-            period_count = data['message_count']
-            if period_count > 0:
-                time_series_list.append({
-                    'date': date,
-                    'message_count': period_count,
-                    'positive_count': data['positive_count'],
-                    'negative_count': data['negative_count'],
-                    'neutral_count': data['neutral_count'],
-                    'total_sentiment_count': data['total_sentiment_count'],
-                    'average_polarity': data['total_polarity'] / period_count,
-                    'average_subjectivity': data['total_subjectivity'] / period_count
-                })
-    
-    return {
-        'overall_stats': overall_stats,
-        'time_series': time_series_list
-    }
-
-def main():
+        else:
+            for label, data in sorted(rows.values(), key=lambda row: row[0]):
+                time_series_list.append({'date': label, **data})
+        
+        return {
+            'overall_stats': overall_stats,
+            'time_series': time_series_list
+        }
+
+def scored_batches(messages, cache=None, workers=1, chunk_size=2000, backend='textblob', memo=None):
+    # Score batches and parse their timestamps in bulk
+    for batch, polarity, subjectivity in iter_score_batches(messages, cache, workers, chunk_size, backend, memo):
+        with tracer.stage('parse_timestamps', messages=len(batch)):
+            epochs = parse_timestamps(message['Timestamp'] for message in batch)
+        yield batch, epochs, polarity, subjectivity
+
+def output_path(path, output_dir):
+    # data/sentiment/sketches/x.npz -> <output_dir>/sketches/x.npz
+    return os.path.join(output_dir, os.path.relpath(path, DEFAULT_OUTPUT_DIR))
+
+def range_output_dir(start=None, end=None):
+    # data/sentiment/range_2024-01-01_end, a range never overwrites the results of the full history
+    bounds = [re.sub(r'[^0-9A-Za-z.-]+', '-', bound) if bound else default
+              for bound, default in ((start, 'start'), (end, 'end'))]
+    return os.path.join(DEFAULT_OUTPUT_DIR, f'range_{bounds[0]}_{bounds[1]}')
+
+def state_path(file_type, output_dir=DEFAULT_OUTPUT_DIR):
+    return os.path.join(output_dir, 'state', f'{file_type}_state.json')
+
+def load_aggregator_state(file_type, periods, scorer_version, output_dir=DEFAULT_OUTPUT_DIR):
+    # Returns None when there is no usable state and a full run is needed
+    try:
+        state = load_json_file(state_path(file_type, output_dir))
+    except FileNotFoundError:
+        print(f"No previous state for {file_type}, running a full analysis")
+        return None
+    
+    if state['scorer_version'] != scorer_version or state['periods'] != periods:
+        print(f"State for {file_type} was built with different settings, running a full analysis")
+        return None
+    return SentimentAggregator.from_state(state)
+
+def load_rollup_builder(scorer_version, channel_table, path=DEFAULT_ROLLUP_PATH):
+    # Returns None when there is no rollup from the same scorer to continue
+    try:
+        rollup = RollupBuilder.load(path, channel_table)
+    except FileNotFoundError:
+        return None
+    return rollup if rollup.scorer_version == scorer_version else None
+
+def analyze_messages(messages, period='day', backend='textblob'):
+    aggregator = SentimentAggregator([period])
+    for _, epochs, polarity, subjectivity in scored_batches(messages, backend=backend):
+        aggregator.add_batch(epochs, polarity, subjectivity)
+    return aggregator.results(period)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Sentiment analysis of the combined Discord messages')
+    parser.add_argument('--scorer', choices=sorted(BACKENDS), default='textblob',
+                        help='Sentiment backend, lexicon is a faster port of the TextBlob lexicon '
+                             '(check its drift with sentiment_backends.py)')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                        help='Path of the sentiment score cache')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Score every message without reading or writing the cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Invalidate cached scores before analyzing')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Scoring processes, 0 uses every core (default: 1, serial)')
+    parser.add_argument('--memo-size', type=int, default=MEMO_ENTRIES,
+                        help='Distinct texts whose scores are remembered for repeats, least recently used go first')
+    parser.add_argument('--chunk-size', type=int, default=2000,
+                        help='Messages per task sent to a scoring process')
+    parser.add_argument('--input', choices=['json', 'store'], default='json',
+                        help='Read data/raw/*.json or the columnar message store')
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH,
+                        help='Path of the columnar message store written by combine-messages')
+    parser.add_argument('--output', choices=['json', 'store', 'both'], default='json',
+                        help='Write the per-period JSON files, one compact columnar store, or both')
+    parser.add_argument('--rollup', action='store_true',
+                        help=f'Also write hourly per-channel sums to {DEFAULT_ROLLUP_PATH} for range queries')
+    parser.add_argument('--breakdown', action='store_true',
+                        help='Also write per guild and per channel results with top-N rankings (implies --rollup)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help='Groups per ranking and with a time series in the breakdown, 0 for all')
+    parser.add_argument('--sketches', action='store_true',
+                        help='Also write score quantiles and distinct channel counts per period from mergeable sketches')
+    parser.add_argument('--scores-out', metavar='DIR',
+                        help='Also write per-message scores as a columnar table under DIR/<file_type>')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only score messages newer than the last run and merge them into its sums')
+    parser.add_argument('--start', help="Only analyze messages from this time on, 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument('--end', help="Only analyze messages before this time (exclusive), 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument('--output-dir',
+                        help=f'Directory of the results (default: {DEFAULT_OUTPUT_DIR}, '
+                             f'or {DEFAULT_OUTPUT_DIR}/range_<start>_<end> with --start or --end)')
+    add_trace_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    if args.breakdown:
+        # The breakdown is read from the rollup, the same single scan feeds both
+        args.rollup = True
+    if args.incremental and args.scores_out:
+        parser.error('--scores-out needs a full run, it cannot be combined with --incremental')
+    if args.incremental and (args.start or args.end):
+        parser.error('--start and --end cannot be combined with --incremental, it continues the full history')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_tracing(args)
+    workers = args.workers or os.cpu_count()
     periods = ['day', 'month', 'weekday', 'hour', 'day_hour']  # Added day_hour
     file_types = ['dm_messages', 'guild_messages', 'all_messages']
+    scorer_version = get_scorer(args.scorer).version
+    # Results of a time range go to their own directory and must never be resumed as the full history
+    ranged = bool(args.start or args.end)
+    resume_version = None if ranged else scorer_version
+    output_dir = args.output_dir or (range_output_dir(args.start, args.end) if ranged else DEFAULT_OUTPUT_DIR)
+    rollup_path = output_path(DEFAULT_ROLLUP_PATH, output_dir)
+    if output_dir != DEFAULT_OUTPUT_DIR:
+        print(f"Writing the results to {output_dir}")
+    memo = ScoreMemo(args.memo_size)  # Shared by the file types, all_messages repeats the DM and guild texts
+    store_results = {}
+    sketches_by_type = {}
+    
+    rollup = None
+    rollup_resumed = False
+    channel_table = {}
+    if args.rollup:
+        # Built from the DM and guild passes, all_messages holds the same messages again
+        channel_table = load_channel_table()
+        rollup = load_rollup_builder(scorer_version, channel_table, rollup_path) if args.incremental else None
+        rollup_resumed = rollup is not None
+        if rollup is None:
+            rollup = RollupBuilder(channel_table)
+    
+    # Decided for every file type before any scan, the rollup is resumed once for all of them
+    states = {}
+    if args.incremental:
+        states = {file_type: load_aggregator_state(file_type, periods, scorer_version, output_dir)
+                  for file_type in file_types}
+    if rollup_resumed and any(states[file_type] is None for file_type in file_types
+                              if FILE_TYPE_FILTERS[file_type] is not None):
+        # A file type scanned in full would be added to the resumed rollup a second time
+        print("Not every file type can resume, the rollup needs a full run and is skipped")
+        rollup = None
+    
+    cache = None
+    if not args.no_cache:
+        cache = SentimentCache(args.cache, scorer_version)
+        if args.clear_cache:
+            print(f"Cleared {cache.invalidate():,} cached scores")
+    
+    store = None
+    if args.input == 'store':
+        try:
+            store = MessageStore(args.store)
+        except FileNotFoundError:
+            print(f"Message store not found: {args.store}")
+            return
     
     for file_type in file_types:
         print(f"\nAnalyzing {file_type}...")
-        try:
-            messages = load_json_file(f'data/raw/{file_type}.json')
-            
-            for period in periods:
-                results = analyze_messages(messages, period)
-                save_json_file(f'data/sentiment/{file_type}_sentiment_{period}.json', results)
+        with tracer.stage('analyze', file_type=file_type):
+            try:
+                if store is not None:
+                    # Memory-mapped scan of the rows for this file type
+                    ingest = None
+                    messages = store.iter_messages(file_type, start=args.start, end=args.end)
+                elif ranged:
+                    # Binary search the time index, only the range is read and parsed
+                    ingest = IngestStats()
+                    messages = iter_messages_between(f'data/raw/{file_type}.json', args.start, args.end, ingest)
+                else:
+                    # Stream the messages instead of loading the whole array
+                    ingest = IngestStats()
+                    messages = iter_json_array(f'data/raw/{file_type}.json', ingest)
                 
-                # Print summary
-                stats = results['overall_stats']
-                print(f"\nResults for {file_type} (by {period}):")
-                print(f"Total messages: {stats['message_count']:,}")
-                print(f"Positive messages: {stats['positive_count']:,}")
-                print(f"Negative messages: {stats['negative_count']:,}")
-                print(f"Neutral messages: {stats['neutral_count']:,}")
-                print(f"Average polarity: {stats['average_polarity']:.3f}")
-                print(f"Average subjectivity: {stats['average_subjectivity']:.3f}")
+                # Score once and stream the scores into every period's aggregation
+                aggregator = states.get(file_type)
+                resumed = False
+                if aggregator is None:
+                    aggregator = SentimentAggregator(periods)
+                else:
+                    resumed = True
+                    print(f"Resuming {file_type} after {aggregator.message_count:,} messages")
+                    messages = aggregator.iter_new_messages(messages)
+                    if rollup is not None and not rollup_resumed:
+                        print("No rollup to resume, it needs a full run and is skipped")
+                        rollup = None
                 
-        except FileNotFoundError:
-            print(f"File not found: data/raw/{file_type}.json")
+                sketches = None
+                sketches_merged = False
+                if args.sketches:
+                    parts = [sketches_by_type.get(part) for part in ('dm_messages', 'guild_messages')]
+                    if file_type == 'all_messages' and None not in parts:
+                        # Merging the DM and guild sketches is exact, no need to add the messages again
+                        sketches = parts[0].merge(parts[1])
+                        sketches_merged = True
+                    elif resumed:
+                        sketches = SentimentSketches.load(output_path(sketch_path(file_type), output_dir), scorer_version)
+                        if sketches is None:
+                            print("No sketches to resume, they need a full run and are skipped")
+                    else:
+                        sketches = SentimentSketches()
+                
+                writer = None
+                if args.scores_out:
+                    writer = ScoreTableWriter(os.path.join(args.scores_out, file_type))
+                
+                for batch, epochs, polarity, subjectivity in scored_batches(messages, cache, workers, args.chunk_size, args.scorer, memo):
+                    with tracer.stage('aggregate', messages=len(batch)):
+                        aggregator.add_batch(epochs, polarity, subjectivity)
+                        aggregator.track_high_water(batch, epochs)
+                    if rollup is not None and FILE_TYPE_FILTERS[file_type] is not None:
+                        with tracer.stage('rollup', messages=len(batch)):
+                            rollup.add_batch(FILE_TYPE_FILTERS[file_type], batch, epochs, polarity, subjectivity)
+                    if sketches is not None and not sketches_merged:
+                        with tracer.stage('sketches', messages=len(batch)):
+                            sketches.add_batch(batch, epochs, polarity, subjectivity)
+                    if writer is not None:
+                        with tracer.stage('write_scores', messages=len(batch)):
+                            writer.append_batch(batch, epochs, polarity, subjectivity)
+                
+                if writer is not None:
+                    writer.close()
+                if ingest is not None:
+                    print(ingest.report())
+                    tracer.count('bytes_read', ingest.bytes_read)
+                    tracer.count('json_parse_seconds', ingest.parse_seconds)
+                
+                # Keep the raw sums so the next run can be incremental
+                if not ranged:
+                    with tracer.stage('save_state'):
+                        save_json_file(state_path(file_type, output_dir), aggregator.to_state(scorer_version))
+                
+                if sketches is not None:
+                    with tracer.stage('save_sketches'):
+                        sketches.save(output_path(sketch_path(file_type), output_dir), resume_version)
+                        for period in periods:
+                            save_json_file(output_path(quantiles_path(file_type, period), output_dir), sketches.results(period))
+                    sketches_by_type[file_type] = sketches
+                    stats = sketches.results('day')['overall_stats']
+                    print(f"Median polarity {stats['polarity_median']}, p10 {stats['polarity_p10']}, "
+                          f"p90 {stats['polarity_p90']}, about {stats['distinct_channels']:,} channels")
+                
+                for period in periods:
+                    with tracer.stage('results', period=period):
+                        results = aggregator.results(period)
+                    rolling = None
+                    if period in ROLLING_PERIODS:
+                        # Every window at once, the visualizer and the website only look them up
+                        with tracer.stage('rolling', period=period):
+                            rolling = rolling_results(results['time_series'])
+                    if args.output in ('json', 'both'):
+                        with tracer.stage('save_json', period=period):
+                            save_json_file(os.path.join(output_dir, f'{file_type}_sentiment_{period}.json'), results)
+                            if rolling is not None:
+                                save_json_file(output_path(rolling_path(file_type, period), output_dir), rolling)
+                    if args.output in ('store', 'both'):
+                        store_results.setdefault(file_type, {})[period] = dict(results, rolling=rolling)
+                    
+                    # Print summary
+                    stats = results['overall_stats']
+                    print(f"\nResults for {file_type} (by {period}):")
+                    print(f"Total messages: {stats['message_count']:,}")
+                    print(f"Positive messages: {stats['positive_count']:,}")
+                    print(f"Negative messages: {stats['negative_count']:,}")
+                    print(f"Neutral messages: {stats['neutral_count']:,}")
+                    print(f"Average polarity: {stats['average_polarity']:.3f}")
+                    print(f"Average subjectivity: {stats['average_subjectivity']:.3f}")
+                    
+            except FileNotFoundError:
+                print(f"File not found: data/raw/{file_type}.json")
+        tracer.snapshot(f'after {file_type}')
+    
+    if rollup is not None:
+        with tracer.stage('save_rollup'):
+            rollup.save(rollup_path, resume_version)
+        print(f"\nSaved {len(rollup.keys):,} hourly channel buckets to {rollup_path}")
+    
+    if rollup is not None and args.breakdown:
+        index = RollupIndex.from_builder(rollup)
+        for file_type in file_types:
+            channel_type = FILE_TYPE_FILTERS[file_type]
+            for by in BREAKDOWNS:
+                if by == 'guild' and channel_type == 'DM':
+                    continue  # Every DM falls in the one no-guild group
+                with tracer.stage('breakdown', file_type=file_type, by=by):
+                    breakdown = build_breakdown(index, by, periods, channel_table, channel_type, args.top)
+                    save_json_file(output_path(breakdown_path(file_type, by), output_dir), breakdown)
+                if file_type == 'all_messages':
+                    print_ranking(breakdown, min(args.top or 5, 5))
+        print(f"\nSaved the guild and channel breakdowns to {output_dir}/*_sentiment_by_*.json")
+    
+    if store_results:
+        with tracer.stage('save_store'):
+            save_sentiment_store(store_results, output_dir)
+        print(f"\nSaved the sentiment store to {output_dir}")
+    
+    stats = memo.stats()
+    if stats['texts'] > 0:
+        print(f"\nDeduplicated texts: {stats['unique']:,} unique of {stats['texts']:,} scored "
+              f"({stats['dedup_ratio']:.1%} repeats), about {stats['seconds_saved']:.1f}s of scoring saved")
+    
+    if cache is not None:
+        stats = cache.stats()
+        print(f"\nSentiment cache: {stats['hits']:,} hits, {stats['misses']:,} misses "
+              f"({stats['hit_rate']:.1%} hit rate), {stats['entries']:,} entries")
+        cache.close()
+    
+    finish_tracing(args)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from timestamps import format_timestamps, parse_timestamp
+
+# Discord snowflakes count milliseconds from the start of 2015
+DISCORD_EPOCH_MS = 1420070400000
+
+# A mix of lexicon words (so TextBlob has something to score) and neutral filler
+POSITIVE_WORDS = ['good', 'great', 'happy', 'love', 'nice', 'awesome', 'fun', 'best', 'cool', 'beautiful']
+NEGATIVE_WORDS = ['bad', 'sad', 'hate', 'terrible', 'boring', 'worst', 'awful', 'annoying', 'wrong', 'ugly']
+MODIFIERS = ['very', 'really', 'not', 'never', 'so', 'pretty', 'quite']
+FILLER_WORDS = ['the', 'a', 'is', 'was', 'game', 'today', 'i', 'you', 'we', 'this', 'that', 'it', 'to',
+                'and', 'of', 'in', 'on', 'with', 'class', 'exam', 'tomorrow', 'server', 'match', 'just']
+PUNCTUATION = ['', '', '', '!', '?', '...', ' :)', ' :(']
+# Short messages that repeat all over a real chat history
+COMMON_MESSAGES = ['lol', 'ok', 'okay', 'lmao', 'yes', 'no', 'xd', 'thanks', 'gg', 'haha', ':)', 'nice', 'what',
+                   'https://tenor.com/view/cat-gif', 'same']
+
+def channel_weights(channels, rng):
+    # Chat activity is skewed, a few channels hold most of the messages
+    weights = 1.0 / np.arange(1, channels + 1) ** 1.1
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+def make_texts(count, mean_words, repeat_share, empty_share, rng):
+    vocabulary = np.array(POSITIVE_WORDS + NEGATIVE_WORDS + MODIFIERS + FILLER_WORDS * 3)
+    kinds = rng.random(count)
+    # Log-normal message lengths, most messages are short with a long tail
+    lengths = np.maximum(1, rng.lognormal(np.log(max(mean_words, 1)) - 0.5, 1.0, count).astype(np.int64))
+    words = vocabulary[rng.integers(0, len(vocabulary), int(lengths.sum()))].tolist()
+    common = rng.integers(0, len(COMMON_MESSAGES), count).tolist()
+    punctuation = rng.integers(0, len(PUNCTUATION), count).tolist()
+
+    texts = []
+    position = 0
+    for index, length in enumerate(lengths.tolist()):
+        if kinds[index] < empty_share:
+            texts.append('')  # Attachment only
+        elif kinds[index] < empty_share + repeat_share:
+            texts.append(COMMON_MESSAGES[common[index]])
+        else:
+            texts.append(' '.join(words[position:position + length]) + PUNCTUATION[punctuation[index]])
+        position += length
+    return texts
+
+def generate_export(output_dir, messages=10000, channels=50, dm_share=0.4, mean_words=8,
+                    repeat_share=0.3, empty_share=0.05, start='2019-01-01 00:00:00',
+                    end='2024-09-30 23:59:59', seed=0):
+    """Write a synthetic Discord data package (c<id>/channel.json + messages.json folders)"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if dm_share <= 0:
+        dm_channels = 0
+    elif dm_share >= 1:
+        dm_channels = channels
+    else:
+        dm_channels = min(channels - 1, max(1, round(channels * dm_share)))
+    guilds = max(1, (channels - dm_channels) // 5)
+    is_dm = np.zeros(channels, dtype=bool)
+    is_dm[:dm_channels] = True
+
+    # Split the messages between DMs and guilds by dm_share, then across channels by activity
+    weights = channel_weights(channels, rng)
+    if 0 < dm_channels < channels:
+        weights[is_dm] *= dm_share / weights[is_dm].sum()
+        weights[~is_dm] *= (1 - dm_share) / weights[~is_dm].sum()
+    channel_of = rng.choice(channels, size=messages, p=weights)
+
+    epochs = rng.integers(parse_timestamp(start), parse_timestamp(end) + 1, messages)
+    milliseconds = epochs * 1000 + rng.integers(0, 1000, messages)
+    ids = ((milliseconds - DISCORD_EPOCH_MS) << 22) + np.arange(messages) % (1 << 22)
+    timestamps = format_timestamps(epochs)
+    texts = make_texts(messages, mean_words, repeat_share, empty_share, rng)
+
+    total_bytes = 0
+    for channel in range(channels):
+        channel_id = str(900000000000000000 + channel)
+        folder = os.path.join(output_dir, f'c{channel_id}')
+        os.makedirs(folder, exist_ok=True)
+
+        if is_dm[channel]:
+            info = {'id': channel_id, 'type': 'DM', 'recipients': ['1', str(100 + channel)]}
+        else:
+            guild = channel % guilds
+            info = {'id': channel_id, 'type': 'GUILD_TEXT', 'name': f'channel-{channel}',
+                    'guild': {'id': str(800000000000000000 + guild), 'name': f'Guild {guild}'}}
+        with open(os.path.join(folder, 'channel.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+
+        # Discord exports each channel newest first
+        rows = np.flatnonzero(channel_of == channel)
+        rows = rows[np.argsort(-ids[rows], kind='stable')].tolist()
+        channel_messages = [{
+            'ID': int(ids[row]),
+            'Timestamp': timestamps[row],
+            'Contents': texts[row],
+            'Attachments': '' if texts[row] else 'https://cdn.discordapp.com/attachments/image.png'
+        } for row in rows]
+        path = os.path.join(folder, 'messages.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(channel_messages, f, ensure_ascii=False)
+        total_bytes += os.path.getsize(path)
+
+    return {
+        'messages': messages,
+        'channels': channels,
+        'dm_channels': dm_channels,
+        'bytes': total_bytes
+    }
+
+def add_generator_arguments(parser):
+    parser.add_argument('--channels', type=int, default=50, help='Number of channel folders')
+    parser.add_argument('--dm-share', type=float, default=0.4, help='Share of the messages sent in DMs')
+    parser.add_argument('--mean-words', type=float, default=8, help='Typical words per message')
+    parser.add_argument('--repeat-share', type=float, default=0.3,
+                        help='Share of short repeated messages like "lol" or "ok"')
+    parser.add_argument('--empty-share', type=float, default=0.05, help='Share of attachment-only messages')
+    parser.add_argument('--seed', type=int, default=0)
+
+def generator_options(args):
+    return {
+        'channels': args.channels,
+        'dm_share': args.dm_share,
+        'mean_words': args.mean_words,
+        'repeat_share': args.repeat_share,
+        'empty_share': args.empty_share,
+        'seed': args.seed
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Discord messages export')
+    parser.add_argument('output_dir', nargs='?', default='messages')
+    parser.add_argument('--messages', type=int, default=10000, help='Total number of messages')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    summary = generate_export(args.output_dir, args.messages, **generator_options(args))
+    print(f"Wrote {summary['messages']:,} messages in {summary['channels']} channels "
+          f"({summary['dm_channels']} DMs), {summary['bytes'] / (1024 * 1024):,.1f} MB")
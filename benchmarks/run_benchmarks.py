@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from generate_export import add_generator_arguments, generate_export, generator_options
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['combine', 'analyze', 'visualize']
+DEFAULT_SCALES = [10000, 100000, 1000000]
+
+def stage_command(stage, options):
+    # Every stage runs its own script, in a working directory holding messages/, data/ and graphs/
+    workers = str(options['workers'])
+    if stage == 'combine':
+        return ['combine-messages.py', '--workers', workers]
+    elif stage == 'analyze':
+        return ['analyze_sentiment.py', '--no-cache', '--workers', workers, '--scorer', options['scorer']]
+    elif stage == 'visualize':
+        return ['visualize_sentiment.py', '--force', '--workers', workers]
+    raise ValueError(f"Unknown stage: {stage}")
+
+def measure_stage(stage, workdir, options):
+    """Wall time and peak RSS of one stage, each stage is a separate process so nothing is shared"""
+    script, *arguments = stage_command(stage, options)
+    log_path = os.path.join(workdir, f'{stage}.log')
+
+    with open(log_path, 'w', encoding='utf-8') as log:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, script)] + arguments,
+                                   cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        peak_rss_mb = None
+        if hasattr(os, 'wait4'):
+            # The child's own rusage, ru_maxrss is KB on Linux and bytes on macOS
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:  # Windows
+            returncode = process.wait()
+        seconds = time.perf_counter() - started
+
+    if returncode != 0:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as log:
+            tail = log.read().strip().splitlines()[-1:]
+        return {'error': tail[0] if tail else f"exit code {returncode}", 'log': log_path}
+    return {
+        'seconds': seconds,
+        'peak_rss_mb': peak_rss_mb
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scales, stages, options, generator, base_dir=None, keep=False):
+    results = []
+    for messages in scales:
+        workdir = tempfile.mkdtemp(prefix=f'bench-{messages}-', dir=base_dir)
+        print(f"\n{messages:,} messages in {workdir}")
+        try:
+            started = time.perf_counter()
+            export = generate_export(os.path.join(workdir, 'messages'), messages, **generator)
+            run = {
+                'messages': messages,
+                'export_bytes': export['bytes'],
+                'generate_seconds': time.perf_counter() - started,
+                'stages': {}
+            }
+            print(f"  generate: {run['generate_seconds']:.1f}s, {export['bytes'] / (1024 * 1024):,.1f} MB")
+
+            for stage in stages:
+                stage_result = measure_stage(stage, workdir, options)
+                if 'seconds' in stage_result:
+                    stage_result['messages_per_second'] = messages / max(stage_result['seconds'], 1e-9)
+                    rss = stage_result['peak_rss_mb']
+                    print(f"  {stage}: {stage_result['seconds']:.1f}s, "
+                          f"{stage_result['messages_per_second']:,.0f} msgs/s"
+                          + (f", peak RSS {rss:,.0f} MB" if rss is not None else ''))
+                else:
+                    print(f"  {stage}: failed, {stage_result['error']} (see {stage_result['log']})")
+                run['stages'][stage] = stage_result
+            results.append(run)
+        finally:
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def print_comparison(previous, current):
+    # Seconds of matching (scale, stage) pairs, ratio > 1 means the current run is slower
+    old = {(run['messages'], stage): result.get('seconds')
+           for run in previous['runs'] for stage, result in run['stages'].items()}
+    print(f"\nCompared with {previous.get('git_commit') or 'the previous run'}:")
+    for run in current['runs']:
+        for stage, result in run['stages'].items():
+            before = old.get((run['messages'], stage))
+            after = result.get('seconds')
+            if before and after:
+                print(f"  {run['messages']:>10,} {stage:<10} {before:8.2f}s -> {after:8.2f}s ({after / before:.2f}x)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark combine, analyze and visualize on synthetic exports')
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in DEFAULT_SCALES),
+                        help='Comma separated message counts (default: 10000,100000,1000000)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma separated stages to run')
+    parser.add_argument('--workers', type=int, default=1, help='Workers passed to every stage, 0 uses every core')
+    parser.add_argument('--scorer', default='textblob', help='Sentiment backend for the analyze stage')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', metavar='RESULTS', help='Print timings relative to an earlier results file')
+    parser.add_argument('--workdir', help='Directory for the temporary exports (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated exports and stage logs')
+    add_generator_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    for stage in stages:
+        if stage not in STAGES:
+            raise SystemExit(f"Unknown stage: {stage}, expected one of {', '.join(STAGES)}")
+    # Visualize reads what analyze wrote and analyze reads what combine wrote
+    stages = [stage for stage in STAGES if stage in stages]
+    scales = [int(scale) for scale in args.scales.split(',') if scale]
+    options = {
+        'workers': args.workers or os.cpu_count(),
+        'scorer': args.scorer
+    }
+    generator = generator_options(args)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': options,
+        'generator': generator,
+        'runs': run_benchmarks(scales, stages, options, generator, args.workdir, args.keep)
+    }
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(REPO_DIR, 'benchmarks', 'results', f'{stamp}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import json
+from rollup import DEFAULT_ROLLUP_PATH, UNKNOWN_GUILD, RollupIndex, unknown_channel
+from message_store import CHANNEL_TYPES, CHANNELS_PATH, load_channel_table
+
+# Per guild and per channel results, read from the hourly channel buckets analyze builds in its one scan
+DEFAULT_TOP = 10
+MIN_RANKED_MESSAGES = 20  # Fewer scored messages than this are too noisy to rank by polarity
+BREAKDOWNS = ['guild', 'channel']
+DM_GROUP = 'dm'  # Key of the DMs in a guild breakdown, they have no guild ID
+
+# Analysis period -> rollup level giving the same time series
+PERIOD_LEVELS = {
+    'day': 'day',
+    'month': 'month',
+    'weekday': 'weekday',
+    'hour': 'hour_of_day',
+    'day_hour': 'weekday_hour'
+}
+
+def breakdown_path(file_type, by):
+    return f'data/sentiment/{file_type}_sentiment_by_{by}.json'
+
+def group_info(by, group, channel_table):
+    # ID and display names of a group, from data/raw/channels.json
+    if by == 'guild':
+        if not group:
+            return {'id': DM_GROUP, 'name': 'Direct Messages'}
+        if group == UNKNOWN_GUILD:
+            return {'id': group, 'name': 'Unknown guilds'}
+        name = next((info.get('guild_name') for info in channel_table.values()
+                     if info.get('guild_id') == group and info.get('guild_name')), None)
+        return {'id': group, 'name': name or f'Guild {group}'}
+
+    info = channel_table.get(group) or {}
+    unknown = [channel_type for channel_type in CHANNEL_TYPES if group == unknown_channel(channel_type)]
+    if unknown:
+        info = {'type': unknown[0]}
+        name = f'Unknown {unknown[0]} channels'
+    elif info.get('type') == 'DM':
+        name = f'DM {group}'
+    else:
+        name = f"#{info['name']}" if info.get('name') else f'Channel {group}'
+    return {
+        'id': group,
+        'name': name,
+        'type': info.get('type'),
+        'guild_id': info.get('guild_id'),
+        'guild_name': info.get('guild_name')
+    }
+
+def rank(totals, key, reverse, min_messages=0, top=DEFAULT_TOP):
+    # Group IDs ordered by one stat, ties broken by ID so the output is stable
+    groups = [group for group, stats in totals.items() if stats['scored_count'] >= min_messages]
+    ordered = sorted(groups, key=lambda group: (-totals[group][key] if reverse else totals[group][key], group))
+    return ordered[:top] if top else ordered
+
+def build_breakdown(index, by, periods, channel_table, channel_type=None, top=DEFAULT_TOP,
+                    min_messages=MIN_RANKED_MESSAGES):
+    """Overall stats of every group, top-N rankings and the time series of the top groups by messages"""
+    totals = index.group_totals(by, channel_type=channel_type)
+    by_messages = rank(totals, 'message_count', reverse=True, top=0)
+
+    groups = []
+    for position, group in enumerate(by_messages, 1):
+        groups.append({'rank': position, **group_info(by, group, channel_table), **totals[group]})
+
+    # Series for the top groups only, a long tail of quiet channels would dwarf the rest of the file
+    top_groups = by_messages[:top] if top else by_messages
+    time_series = {}
+    for period in periods:
+        series = index.group_series(by, PERIOD_LEVELS[period], groups=top_groups, channel_type=channel_type)
+        time_series[period] = {group or DM_GROUP: series[group] for group in top_groups if group in series}
+
+    rankings = {
+        'most_messages': top_groups,
+        'most_positive': rank(totals, 'average_polarity', True, min_messages, top),
+        'most_negative': rank(totals, 'average_polarity', False, min_messages, top),
+        'most_subjective': rank(totals, 'average_subjectivity', True, min_messages, top)
+    }
+    return {
+        'group_by': by,
+        'top': top,
+        'groups': groups,
+        'rankings': {name: [group or DM_GROUP for group in ranked] for name, ranked in rankings.items()},
+        'time_series': time_series
+    }
+
+def print_ranking(breakdown, top=DEFAULT_TOP):
+    groups = {group['id']: group for group in breakdown['groups']}
+    for ranking, ranked in breakdown['rankings'].items():
+        print(f"\n{ranking.replace('_', ' ').capitalize()} by {breakdown['group_by']}:")
+        for group in ranked[:top]:
+            stats = groups[group]
+            print(f"  {stats['name']:<40} {stats['message_count']:>9,} messages, "
+                  f"polarity {stats['average_polarity']:+.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per guild or per channel breakdown of a saved rollup')
+    parser.add_argument('--rollup', default=DEFAULT_ROLLUP_PATH, help='Path of the rollup file')
+    parser.add_argument('--by', choices=BREAKDOWNS, default='guild')
+    parser.add_argument('--type', choices=CHANNEL_TYPES, help='Only DMs or only guild channels')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='Groups per ranking, 0 for all')
+    parser.add_argument('--json', action='store_true', help='Print the whole breakdown as JSON')
+    args = parser.parse_args()
+
+    breakdown = build_breakdown(RollupIndex(args.rollup), args.by, list(PERIOD_LEVELS),
+                                load_channel_table(CHANNELS_PATH), args.type, args.top)
+    if args.json:
+        print(json.dumps(breakdown, indent=2, ensure_ascii=False))
+    else:
+        print_ranking(breakdown, args.top)
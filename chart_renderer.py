@@ -0,0 +1,290 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import matplotlib.pyplot as plt
+from sentiment_store import DEFAULT_STORE_DIR, SUMMARY_FILE
+from visualize_sentiment import build_plot_jobs, job_fingerprint, render_options, run_plot_job
+
+# Charts drawn when someone asks for them, by the same plot functions and jobs visualize_sentiment uses
+CACHE_DIR = 'graphs/.cache'
+MEMORY_BYTES = 64 * 1024 * 1024
+DISK_BYTES = 512 * 1024 * 1024
+RENDER_DIR = 'graphs'  # Only names the captured outputs, nothing is written there
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'pdf': 'application/pdf',
+    'jpg': 'image/jpeg'
+}
+MIN_DPI, MAX_DPI = 20, 600
+PERIODS = ['day', 'month', 'weekday', 'hour']  # The periods visualize_sentiment draws
+
+# Chart -> variant -> the job output it matches, the first variant is the default
+CHARTS = {
+    'distribution': {None: 'distribution/sentiment_distribution_{file_type}_Overall'},
+    'correlation': {None: 'correlation/polarity_subjectivity_{file_type}'},
+    'momentum': {None: 'momentum/sentiment_momentum_{file_type}'},
+    'volatility': {None: 'volatility/sentiment_volatility_{file_type}'},
+    'volume': {None: 'relationship/volume_sentiment_{file_type}'},
+    'timeline': {
+        'with_neutral': 'timeline_with_neutral/sentiment_timeline_{file_type}_{period}',
+        'without_neutral': 'timeline_without_neutral/sentiment_timeline_{file_type}_{period}',
+        'percentage': 'timeline_percentage/sentiment_timeline_{file_type}_{period}'
+    },
+    'hourly': {None: 'patterns/hourly_sentiment_{file_type}'},
+    'weekday': {None: 'patterns/weekday_sentiment_{file_type}'},
+    'heatmap': {
+        'adjusted': 'patterns/weekly_heatmap_{file_type}_adjusted',
+        'fixed': 'patterns/weekly_heatmap_{file_type}_fixed'
+    }
+}
+
+class MemoryCache:
+    """Least recently used images up to a total size in bytes"""
+
+    def __init__(self, max_bytes=MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.items = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get(self, key):
+        image = self.items.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        if key in self.items:
+            self.bytes -= len(self.items.pop(key))
+        self.items[key] = image
+        self.bytes += len(image)
+        while self.bytes > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+            self.evicted_bytes += len(evicted)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.items),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes
+        }
+
+class DiskCache(MemoryCache):
+    """Same LRU over files in a directory, the order survives restarts through the file mtimes"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=DISK_BYTES):
+        super().__init__(max_bytes)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime_ns, name, stat.st_size))
+        # items holds sizes here, the images stay on disk
+        for _, name, size in sorted(entries):
+            self.items[name] = size
+            self.bytes += size
+
+    def get(self, key):
+        if key not in self.items:
+            self.misses += 1
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                image = f.read()
+        except FileNotFoundError:
+            self.bytes -= self.items.pop(key)
+            self.misses += 1
+            return None
+        os.utime(path)  # Most recently used
+        self.items.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        path = os.path.join(self.directory, key)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(image)
+        os.replace(path + '.tmp', path)
+        if key in self.items:
+            self.bytes -= self.items.pop(key)
+        self.items[key] = len(image)
+        self.bytes += len(image)
+        while self.bytes > self.max_bytes:
+            evicted, size = self.items.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.directory, evicted))
+            except FileNotFoundError:
+                pass
+            self.bytes -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+
+def chart_job(chart, file_type, period, variant=None, source='json', directory=DEFAULT_STORE_DIR):
+    """The visualize_sentiment job drawing one chart variant, None when it has none for the period"""
+    if chart not in CHARTS:
+        raise ValueError(f"Unknown chart {chart}, expected one of {', '.join(CHARTS)}")
+    variants = CHARTS[chart]
+    if variant is None:
+        variant = next(iter(variants))
+    if variant not in variants:
+        raise ValueError(f"Unknown {chart} variant {variant}, expected one of {', '.join(map(str, variants))}")
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period}, expected one of {', '.join(PERIODS)}")
+
+    output = f"{RENDER_DIR}/{variants[variant].format(file_type=file_type, period=period)}.png"
+    for job in build_plot_jobs([file_type], [period], RENDER_DIR, source, directory):
+        if output in job['outputs']:
+            if chart == 'heatmap':
+                # The heatmap job draws both versions, only draw the one asked for
+                job = dict(job, outputs=[output], kwargs={**job['kwargs'], 'versions': [variant]})
+            return job, output
+    return None, output
+
+class ChartRenderer:
+    """Render single charts on request, each image cached in memory and on disk by its data and options"""
+
+    def __init__(self, source='json', directory=DEFAULT_STORE_DIR, cache_dir=CACHE_DIR, memory_bytes=MEMORY_BYTES,
+                 disk_bytes=DISK_BYTES):
+        self.source = source
+        self.directory = directory  # Where analyze_sentiment wrote the results, e.g. a range run's directory
+        self.memory = MemoryCache(memory_bytes)
+        self.disk = DiskCache(cache_dir, disk_bytes) if disk_bytes > 0 else None
+        self.lock = threading.Lock()  # pyplot keeps global state, one figure at a time
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.fingerprints = {}  # (job, kwargs) -> (input mtime, fingerprint)
+
+    def input_mtime(self, job):
+        if self.source == 'store':
+            path = os.path.join(self.directory, SUMMARY_FILE)
+        else:
+            path = os.path.join(self.directory, f"{job['file_type']}_sentiment_{job['period']}.json")
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def fingerprint(self, job):
+        # Hashing the data slice costs more than a cache hit, redo it only when the input file changes
+        key = (job['name'], repr(sorted(job['kwargs'].items())))
+        mtime = self.input_mtime(job)
+        cached = self.fingerprints.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = self.fingerprints[key] = (mtime, job_fingerprint(job, {}))
+        return cached[1]
+
+    def render(self, chart, file_type='all_messages', period='day', variant=None, dpi=100, format='png'):
+        """Image bytes and content type of one chart"""
+        if format not in CONTENT_TYPES:
+            raise ValueError(f"Unknown format {format}, expected one of {', '.join(CONTENT_TYPES)}")
+        dpi = int(dpi)
+        if not MIN_DPI <= dpi <= MAX_DPI:
+            raise ValueError(f"dpi must be between {MIN_DPI} and {MAX_DPI}")
+        job, output = chart_job(chart, file_type, period, variant, self.source, self.directory)
+        if job is None:
+            raise ValueError(f"No {chart} chart for period {period}")
+
+        # Same fingerprint as the build manifest, new analysis output gives new keys
+        fingerprint = self.fingerprint(job)
+        if fingerprint is None:
+            raise FileNotFoundError(f"No {file_type}/{job['period']} results, run analyze_sentiment first")
+        key = hashlib.sha256(f"{fingerprint}|{output}|{dpi}".encode('utf-8')).hexdigest()[:32] + f'.{format}'
+
+        image = self.memory.get(key)
+        if image is None and self.disk is not None:
+            image = self.disk.get(key)
+            if image is not None:
+                self.memory.put(key, image)
+        if image is None:
+            image = self.draw(job, output, dpi, format)
+            self.memory.put(key, image)
+            if self.disk is not None:
+                self.disk.put(key, image)
+        return image, CONTENT_TYPES[format]
+
+    def draw(self, job, output, dpi, format):
+        captured = {}
+        with self.lock:
+            started = time.perf_counter()
+            try:
+                with render_options(dpi, format, captured):
+                    run_plot_job(job)
+            finally:
+                plt.close('all')
+            self.renders += 1
+            self.render_seconds += time.perf_counter() - started
+        image = captured.get(f'{os.path.splitext(output)[0]}.{format}')
+        if image is None:
+            # The plot functions skip periods they cannot draw, e.g. momentum by weekday
+            raise ValueError(f"{job['name']} draws nothing for this period")
+        return image
+
+    def stats(self):
+        return {
+            'renders': self.renders,
+            'render_seconds': self.render_seconds,
+            'memory': self.memory.stats(),
+            'disk': self.disk.stats() if self.disk is not None else None
+        }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render one sentiment chart on demand, through the image cache')
+    parser.add_argument('chart', choices=list(CHARTS))
+    parser.add_argument('--variant', help='timeline: with_neutral, without_neutral or percentage; '
+                                          'heatmap: adjusted or fixed')
+    parser.add_argument('--file-type', default='all_messages')
+    parser.add_argument('--period', default='day')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--format', choices=list(CONTENT_TYPES), default='png')
+    parser.add_argument('--input', choices=['json', 'store'], default='json',
+                        help='Read the per-period JSON files or the columnar sentiment store')
+    parser.add_argument('--directory', default=DEFAULT_STORE_DIR, help='Where analyze_sentiment wrote its output')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', '-o', help='Image path (default: <chart>.<format>)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    renderer = ChartRenderer(args.input, args.directory, args.cache_dir)
+    started = time.perf_counter()
+    try:
+        image, _ = renderer.render(args.chart, args.file_type, args.period, args.variant, args.dpi, args.format)
+    except (ValueError, FileNotFoundError) as e:
+        print(e)
+        return
+    output = args.output or f'{args.chart}.{args.format}'
+    with open(output, 'wb') as f:
+        f.write(image)
+    source = 'rendered' if renderer.renders else 'from the cache'
+    print(f"Wrote {output} ({len(image):,} bytes, {source} in {(time.perf_counter() - started) * 1000:.0f} ms)")
+    print(json.dumps(renderer.stats()['disk'], indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,17 @@
+import argparse
+import heapq
 import json
 import os
-from datetime import datetime
+import numpy as np
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+from instrumentation import add_trace_arguments, finish_tracing, start_tracing, tracer
+from json_stream import IngestStats, JsonArrayWriter, iter_json_array
+from message_store import CHANNELS_PATH, DEFAULT_STORE_PATH, MessageStoreWriter
+from time_index import save_time_index
+from timestamps import parse_timestamp, parse_timestamps
 
 def load_json_file(filepath):
     with open(filepath, 'r', encoding='utf-8') as f:
@@ -12,17 +23,15 @@ def save_json_file(filepath, data):
     
     full_path = os.path.join('data/raw', filepath)
     
-    with open(full_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # Stream the array out instead of building the whole JSON string
+    with JsonArrayWriter(full_path, track_offsets=True) as writer:
+        writer.write_all(data)
+    return full_path, writer.offsets
 
-def combine_messages():
-    dm_messages = []
-    guild_messages = []
-    all_messages = []
-    
-    # Define cutoff date
-    cutoff_date = datetime.strptime('2024-09-30 23:59:59', '%Y-%m-%d %H:%M:%S')
-    
+# Define cutoff date
+CUTOFF_TIMESTAMP = '2024-09-30 23:59:59'
+
+def find_channel_folders(base_dir='./messages'):
     # Walk through all folders in ./messages
     # Folder Structure:
     # ./messages/
@@ -30,41 +39,131 @@ def combine_messages():
     #     - channel.json
     #     - messages.json
     #   - ...
-    for root, dirs, files in os.walk('./messages'):
-        if 'channel.json' in files and 'messages.json' in files:
-            # Load channel info and messages
-            channel_path = os.path.join(root, 'channel.json')
-            messages_path = os.path.join(root, 'messages.json')
-            
-            channel_info = load_json_file(channel_path)
-            messages = load_json_file(messages_path)
-            
-            # Filter messages before adding to lists
-            filtered_messages = [
-                msg for msg in messages 
-                if datetime.strptime(msg['Timestamp'], '%Y-%m-%d %H:%M:%S') <= cutoff_date
-            ]
-            
-            # Add filtered messages to lists
-            if channel_info.get('type') == 'DM':
-                dm_messages.extend(filtered_messages)
-            else:
-                guild_messages.extend(filtered_messages)
-            all_messages.extend(filtered_messages)
+    return [root for root, dirs, files in os.walk(base_dir)
+            if 'channel.json' in files and 'messages.json' in files]
+
+def channel_summary(channel_info):
+    # The parts of channel.json the analysis can group by
+    guild = channel_info.get('guild') or {}
+    return {
+        'id': str(channel_info.get('id', '')),
+        'type': 'DM' if channel_info.get('type') == 'DM' else 'Guild',
+        'name': channel_info.get('name'),
+        'guild_id': guild.get('id'),
+        'guild_name': guild.get('name')
+    }
+
+def load_channel(folder, cutoff_epoch, trace=False):
+    """Load one channel folder, drop messages after the cutoff and sort the rest by time.
+    In a traced worker process the trace events come back with the channel for the parent."""
+    if trace:
+        tracer.enable()
+    first_event = len(tracer.events)  # A forked worker starts with a copy of the parent's events
+    ingest = IngestStats()
+    channel_info = load_json_file(os.path.join(folder, 'channel.json'))
+    channel = channel_summary(channel_info)
+    with tracer.stage('parse_channel', folder=folder):
+        messages = list(iter_json_array(os.path.join(folder, 'messages.json'), ingest))
     
-    # Sort messages by timestamp
-    def sort_by_timestamp(msg):
-        return datetime.strptime(msg['Timestamp'], '%Y-%m-%d %H:%M:%S')
+    # Parse the channel's timestamps once, sort on the integers, a stable sort keeps ties in file order
+    with tracer.stage('parse_timestamps', messages=len(messages)):
+        epochs = parse_timestamps(msg['Timestamp'] for msg in messages)
+    order = np.argsort(epochs, kind='stable')
+    epochs = epochs[order]
     
-    dm_messages.sort(key=sort_by_timestamp)
-    guild_messages.sort(key=sort_by_timestamp)
-    all_messages.sort(key=sort_by_timestamp)
+    # Everything up to the cutoff is a prefix of the sorted channel
+    kept = int(np.searchsorted(epochs, cutoff_epoch, side='right'))
+    messages = [messages[i] for i in order[:kept].tolist()]
+    for msg in messages:
+        msg['ChannelID'] = channel['id']
+    
+    return {
+        'is_dm': channel_info.get('type') == 'DM',
+        'channel': channel,
+        'epochs': epochs[:kept].tolist(),
+        'messages': messages,
+        'bytes_read': ingest.bytes_read,
+        'items': ingest.items,
+        'parse_seconds': ingest.parse_seconds,
+        'trace_events': tracer.drain(first_event) if trace else []
+    }
+
+def merge_channels(channels):
+    # Streaming k-way merge of sorted channels, ties go to the earlier channel like a stable sort would
+    # Yields (epoch, is_dm, message)
+    streams = [zip(channel['epochs'], repeat(channel['is_dm']), channel['messages']) for channel in channels]
+    return heapq.merge(*streams, key=itemgetter(0))
+
+def with_epochs(rows, epochs):
+    # Messages of merged rows, their timestamps collected on the way for the time index
+    for epoch, _, msg in rows:
+        epochs.append(epoch)
+        yield msg
+
+def combine_messages(output_format='json', workers=1):
+    ingest = IngestStats()
+    cutoff_epoch = parse_timestamp(CUTOFF_TIMESTAMP)
+    with tracer.stage('find_channels'):
+        folders = find_channel_folders()
+    
+    # Load and sort channels in parallel, results come back in folder order
+    with tracer.stage('load_channels', channels=len(folders), workers=workers):
+        if workers > 1 and len(folders) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                channels = list(pool.map(load_channel, folders, [cutoff_epoch] * len(folders),
+                                         [tracer.enabled] * len(folders),
+                                         chunksize=max(1, len(folders) // (workers * 4))))
+        else:
+            channels = [load_channel(folder, cutoff_epoch) for folder in folders]
+    
+    for channel in channels:
+        tracer.merge(channel.pop('trace_events'))
+        ingest.bytes_read += channel['bytes_read']
+        ingest.items += channel['items']
+        ingest.parse_seconds += channel['parse_seconds']
+    print(ingest.report())
+    tracer.count('messages', ingest.items)
+    tracer.count('bytes_read', ingest.bytes_read)
+    tracer.count('json_parse_seconds', ingest.parse_seconds)
+    tracer.snapshot('channels loaded')
+    
+    dm_channels = [channel for channel in channels if channel['is_dm']]
+    guild_channels = [channel for channel in channels if not channel['is_dm']]
     
     # Save files
-    save_json_file('dm_messages.json', dm_messages)
-    save_json_file('guild_messages.json', guild_messages)
-    save_json_file('all_messages.json', all_messages)
+    os.makedirs(os.path.dirname(CHANNELS_PATH), exist_ok=True)
+    with open(CHANNELS_PATH, 'w', encoding='utf-8') as f:
+        json.dump(sorted((channel['channel'] for channel in channels), key=lambda channel: channel['id']),
+                  f, indent=2, ensure_ascii=False)
+    
+    if output_format in ('json', 'both'):
+        for filename, group in [('dm_messages.json', dm_channels),
+                                ('guild_messages.json', guild_channels),
+                                ('all_messages.json', channels)]:
+            epochs = array('q')
+            with tracer.stage('write_json', file=filename):
+                path, offsets = save_json_file(filename, with_epochs(merge_channels(group), epochs))
+            with tracer.stage('write_time_index', file=filename):
+                save_time_index(path, epochs, offsets)
+    
+    if output_format in ('store', 'both'):
+        # One columnar copy, dm/guild are filters on the channel type column
+        with tracer.stage('write_store'):
+            writer = MessageStoreWriter(DEFAULT_STORE_PATH)
+            for epoch, is_dm, msg in merge_channels(channels):
+                writer.append(epoch, 'DM' if is_dm else 'Guild', msg)
+            writer.close()
 
 if __name__ == '__main__':
-    combine_messages()
-    print("Combined and sorted messages successfully!")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Combine the per-channel Discord messages')
+    parser.add_argument('--format', choices=['json', 'store', 'both'], default='json',
+                        help='Write data/raw/*.json, the columnar message store, or both')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes loading channel folders, 0 uses every core')
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    
+    start_tracing(args)
+    combine_messages(args.format, args.workers or os.cpu_count())
+    print("Combined and sorted messages successfully!")
+    finish_tracing(args)
\ No newline at end of file
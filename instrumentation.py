@@ -0,0 +1,182 @@
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+
+def current_rss_mb():
+    # Resident set size right now, None where it cannot be read
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / MB
+    except ImportError:
+        return None
+
+class Tracer:
+    """Stage timers, counters and memory snapshots, every call is a no-op until enable()"""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.counters = {}
+        self.profile_stage = None
+        self.profiler = None
+        self.profile_depth = 0
+        self.profiled_calls = 0
+
+    def enable(self, profile_stage=None):
+        self.enabled = True
+        if profile_stage is not None:
+            self.profile_stage = profile_stage
+            self.profiler = cProfile.Profile()
+
+    def now_us(self):
+        # perf_counter is system wide, so events from worker processes line up
+        return time.perf_counter() * 1e6
+
+    @contextmanager
+    def stage(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+
+        profiling = self.profiler is not None and name == self.profile_stage
+        if profiling:
+            # Nested stages of the same name are profiled once, by the outermost
+            if self.profile_depth == 0:
+                self.profiler.enable()
+                self.profiled_calls += 1
+            self.profile_depth += 1
+        rss_before = current_rss_mb()
+        started = self.now_us()
+        try:
+            yield
+        finally:
+            finished = self.now_us()
+            if profiling:
+                self.profile_depth -= 1
+                if self.profile_depth == 0:
+                    self.profiler.disable()
+            self.events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': started,
+                'dur': finished - started,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': dict(args, rss_mb_before=rss_before, rss_mb_after=current_rss_mb())
+            })
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self, label):
+        """Memory at a point in the run, a counter track in the Chrome trace"""
+        if self.enabled:
+            self.events.append({
+                'name': 'memory',
+                'ph': 'C',
+                'ts': self.now_us(),
+                'pid': os.getpid(),
+                'args': {'rss_mb': current_rss_mb()},
+                'label': label
+            })
+
+    def wrap(self, function, name):
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        traced.traced = True
+        return traced
+
+    def patch(self, owner, attribute, name=None):
+        # Time every call to owner.attribute, e.g. plt.savefig inside the plot functions
+        function = getattr(owner, attribute)
+        if not getattr(function, 'traced', False):
+            setattr(owner, attribute, self.wrap(function, name or attribute))
+
+    def drain(self, start=0):
+        """Hand the events recorded since start over, for worker processes to return them to the parent"""
+        events = self.events[start:]
+        del self.events[start:]
+        return events
+
+    def merge(self, events):
+        self.events.extend(events)
+
+    def summary(self):
+        # Stage name -> (calls, total seconds), slowest first
+        totals = {}
+        for event in self.events:
+            if event['ph'] == 'X':
+                calls, seconds = totals.get(event['name'], (0, 0))
+                totals[event['name']] = (calls + 1, seconds + event['dur'] / 1e6)
+        return sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+
+    def print_summary(self):
+        print(f"\n{'Seconds':>8} {'Calls':>7}  Stage")
+        for name, (calls, seconds) in self.summary():
+            print(f"{seconds:8.2f} {calls:7,}  {name}")
+        for name, value in sorted(self.counters.items()):
+            print(f"{name}: {value:,}" if isinstance(value, int) else f"{name}: {value:,.2f}")
+
+    def write(self, path):
+        """Chrome trace format for .json (chrome://tracing, Perfetto), JSON lines otherwise"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                json.dump({
+                    'traceEvents': self.events,
+                    'displayTimeUnit': 'ms',
+                    'otherData': {'counters': self.counters}
+                }, f)
+            else:
+                for event in self.events:
+                    f.write(json.dumps(event) + '\n')
+                f.write(json.dumps({'name': 'counters', 'ph': 'counters', 'args': self.counters}) + '\n')
+
+    def write_profile(self, path, top=25):
+        if self.profiled_calls == 0:
+            print(f"\nStage '{self.profile_stage}' never ran, nothing was profiled")
+            return
+        self.profiler.dump_stats(path)
+        print(f"\ncProfile of stage '{self.profile_stage}' written to {path}, top {top} by cumulative time:")
+        pstats.Stats(path).sort_stats('cumulative').print_stats(top)
+
+# One tracer per process, the scripts and their helpers all report into it
+tracer = Tracer()
+
+def add_trace_arguments(parser):
+    parser.add_argument('--trace', metavar='PATH',
+                        help='Record stage timings, counters and memory to PATH '
+                             '(.json for Chrome trace format, anything else for JSON lines)')
+    parser.add_argument('--profile', metavar='STAGE',
+                        help='Run cProfile around every call of one stage and print the hottest functions')
+
+def start_tracing(args):
+    if args.trace or args.profile:
+        tracer.enable(args.profile)
+        tracer.snapshot('start')
+
+def finish_tracing(args):
+    if not tracer.enabled:
+        return
+    tracer.snapshot('end')
+    tracer.print_summary()
+    if args.trace:
+        tracer.write(args.trace)
+        print(f"Trace written to {args.trace}")
+    if args.profile:
+        tracer.write_profile(f'profile_{args.profile}.prof')
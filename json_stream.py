@@ -0,0 +1,152 @@
+import codecs
+import json
+import os
+import time
+from array import array
+from itertools import islice
+
+class IngestStats:
+    """Bytes and items read by the streaming reader, for throughput reporting"""
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.items = 0
+        self.parse_seconds = 0  # Time spent inside the reader, excluding the consumer
+        self.started = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def report(self, label='messages'):
+        parse_seconds = max(self.parse_seconds, 1e-9)
+        mb = self.bytes_read / (1024 * 1024)
+        return (f"Read {mb:,.1f} MB, {self.items:,} {label} in {self.parse_seconds:.1f}s of parsing "
+                f"({mb / parse_seconds:,.1f} MB/s, {self.items / parse_seconds:,.0f} {label}/s, "
+                f"{self.elapsed():.1f}s wall)")
+
+def iter_json_array(filepath, stats=None, read_size=1 << 20, offset=None):
+    """Yield the elements of a top-level JSON array one at a time, from the start of the array
+    or from the element starting at byte offset (as recorded by JsonArrayWriter)"""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    resumed = time.perf_counter()
+
+    with open(filepath, 'rb') as f:
+        if offset is not None:
+            f.seek(offset)
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def read_more():
+            nonlocal buffer, pos, eof
+            chunk = f.read(read_size)
+            if stats is not None:
+                stats.bytes_read += len(chunk)
+            eof = not chunk
+            buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                read_more()
+
+        skip_whitespace()
+        if offset is None:
+            if buffer[pos:pos + 1] == '\ufeff':  # Byte order mark
+                pos += 1
+                skip_whitespace()
+            if buffer[pos:pos + 1] != '[':
+                raise ValueError(f"{filepath} does not contain a JSON array")
+            pos += 1
+
+        expect_comma = False
+        while True:
+            skip_whitespace()
+            if pos >= len(buffer):
+                raise ValueError(f"Unexpected end of file in {filepath}")
+            if buffer[pos] == ']':
+                if stats is not None:
+                    stats.parse_seconds += time.perf_counter() - resumed
+                return
+            if expect_comma:
+                if buffer[pos] != ',':
+                    raise ValueError(f"Expected ',' at character {pos} of the buffer in {filepath}")
+                pos += 1
+                expect_comma = False
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+
+            # A number cut off by the buffer still decodes ("1.5e" -> 1), so only accept
+            # a value once the next ',' or ']' is in the buffer
+            after = end
+            while after < len(buffer) and buffer[after] in ' \t\r\n':
+                after += 1
+            if not eof and (after == len(buffer) or buffer[after] not in ',]'):
+                read_more()
+                continue
+
+            pos = end
+            expect_comma = True
+            if stats is not None:
+                stats.items += 1
+                stats.parse_seconds += time.perf_counter() - resumed
+            yield item
+            resumed = time.perf_counter()
+
+def iter_json_batches(filepath, batch_size=10000, stats=None):
+    items = iter_json_array(filepath, stats)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+class JsonArrayWriter:
+    """Writes a JSON array element by element, byte-identical to json.dump(items, indent=2)"""
+
+    def __init__(self, filepath, track_offsets=False):
+        self.f = open(filepath, 'wb')
+        self.count = 0
+        self.position = 0  # Bytes written so far
+        self.offsets = array('q') if track_offsets else None  # Byte offset of every element
+
+    def _write(self, text):
+        # Written as bytes to know the offsets, newlines translated like a text mode file would
+        data = text.replace('\n', os.linesep).encode('utf-8')
+        self.f.write(data)
+        self.position += len(data)
+
+    def write(self, item):
+        text = json.dumps(item, indent=2, ensure_ascii=False)
+        self._write('[\n  ' if self.count == 0 else ',\n  ')
+        if self.offsets is not None:
+            self.offsets.append(self.position)
+        self._write(text.replace('\n', '\n  '))
+        self.count += 1
+
+    def write_all(self, items):
+        for item in items:
+            self.write(item)
+
+    def close(self):
+        self._write('[]' if self.count == 0 else '\n]')
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
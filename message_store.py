@@ -0,0 +1,139 @@
+import json
+import os
+import numpy as np
+from array import array
+from time_index import range_bounds
+from timestamps import format_timestamps
+
+# One columnar dataset holds every message; dm/guild/all are filters over it
+CHANNEL_TYPES = ['DM', 'Guild']
+FILE_TYPE_FILTERS = {
+    'all_messages': None,
+    'dm_messages': 'DM',
+    'guild_messages': 'Guild'
+}
+STRING_COLUMNS = ['Contents', 'Attachments']
+DEFAULT_STORE_PATH = 'data/raw/messages_store'
+# Channel ID -> type, name and guild of every exported channel, written next to the combined files
+CHANNELS_PATH = 'data/raw/channels.json'
+
+def load_channel_table(path=CHANNELS_PATH):
+    """Channel ID -> channel info, empty when the combined data predates the table"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return {channel['id']: channel for channel in json.load(f)}
+    except FileNotFoundError:
+        return {}
+
+class MessageStoreWriter:
+    """Builds a store from timestamp-sorted rows in a single streaming pass"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.epochs = array('q')
+        self.ids = array('q')
+        self.channel_types = array('b')
+        self.channel_ids = array('q')
+        # Every string column is one UTF-8 blob plus an offsets array
+        self.string_files = {name: open(os.path.join(directory, f'{name}.bin'), 'wb') for name in STRING_COLUMNS}
+        self.string_offsets = {name: array('q', [0]) for name in STRING_COLUMNS}
+
+    def append(self, epoch, channel_type, message):
+        self.epochs.append(epoch)
+        self.ids.append(int(message['ID']))
+        self.channel_types.append(CHANNEL_TYPES.index(channel_type))
+        self.channel_ids.append(int(message.get('ChannelID') or -1))
+        for name in STRING_COLUMNS:
+            encoded = (message.get(name) or '').encode('utf-8')
+            self.string_files[name].write(encoded)
+            offsets = self.string_offsets[name]
+            offsets.append(offsets[-1] + len(encoded))
+
+    def close(self):
+        np.save(os.path.join(self.directory, 'timestamp.npy'), np.frombuffer(self.epochs, dtype=np.int64))
+        np.save(os.path.join(self.directory, 'id.npy'), np.frombuffer(self.ids, dtype=np.int64))
+        np.save(os.path.join(self.directory, 'channel_type.npy'), np.frombuffer(self.channel_types, dtype=np.int8))
+        np.save(os.path.join(self.directory, 'channel_id.npy'), np.frombuffer(self.channel_ids, dtype=np.int64))
+        for name in STRING_COLUMNS:
+            self.string_files[name].close()
+            np.save(os.path.join(self.directory, f'{name}_offsets.npy'),
+                    np.frombuffer(self.string_offsets[name], dtype=np.int64))
+
+        meta = {
+            'rows': len(self.epochs),
+            'channel_types': CHANNEL_TYPES,
+            'string_columns': STRING_COLUMNS
+        }
+        with open(os.path.join(self.directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+class MessageStore:
+    """Memory-mapped read access to a store written by MessageStoreWriter"""
+
+    def __init__(self, directory=DEFAULT_STORE_PATH):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+        self.directory = directory
+        self.rows = self.meta['rows']
+        self.channel_types = self.meta['channel_types']
+        self.timestamp = self._load('timestamp.npy')
+        self.id = self._load('id.npy')
+        self.channel_type = self._load('channel_type.npy')
+        # Stores written before channel IDs were kept have no channel_id column
+        has_channel_ids = os.path.exists(os.path.join(directory, 'channel_id.npy'))
+        self.channel_id = self._load('channel_id.npy') if has_channel_ids else None
+        self.strings = {}
+
+    def _load(self, filename):
+        # Zero-length arrays cannot be memory-mapped
+        mmap_mode = 'r' if self.rows > 0 else None
+        return np.load(os.path.join(self.directory, filename), mmap_mode=mmap_mode)
+
+    def string_column(self, name):
+        if name not in self.strings:
+            offsets = self._load(f'{name}_offsets.npy')
+            path = os.path.join(self.directory, f'{name}.bin')
+            if offsets[-1] > 0:
+                data = np.memmap(path, dtype=np.uint8, mode='r')
+            else:
+                data = np.zeros(0, dtype=np.uint8)
+            self.strings[name] = (data, offsets)
+        return self.strings[name]
+
+    def text(self, name, row):
+        data, offsets = self.string_column(name)
+        return data[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def row_bounds(self, start=None, end=None):
+        # The rows are stored in timestamp order, the timestamp column is the store's time index
+        return range_bounds(self.timestamp, start, end)
+
+    def rows_for(self, file_type='all_messages', start=None, end=None):
+        first, last = self.row_bounds(start, end)
+        channel_type = FILE_TYPE_FILTERS[file_type]
+        if channel_type is None:
+            return np.arange(first, last)
+        code = self.channel_types.index(channel_type)
+        return np.flatnonzero(self.channel_type[first:last] == code) + first
+
+    def iter_messages(self, file_type='all_messages', batch_size=65536, start=None, end=None):
+        """Yield message dicts for one file type in timestamp order, optionally only start <= timestamp < end"""
+        rows = self.rows_for(file_type, start, end)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            timestamps = format_timestamps(self.timestamp[batch])
+            ids = self.id[batch].tolist()
+            channel_ids = self.channel_id[batch].tolist() if self.channel_id is not None else [-1] * len(batch)
+            for row, message_id, timestamp, channel_id in zip(batch.tolist(), ids, timestamps, channel_ids):
+                yield {
+                    'ID': message_id,
+                    'Timestamp': timestamp,
+                    'Contents': self.text('Contents', row),
+                    'ChannelID': str(channel_id) if channel_id >= 0 else None
+                }
+
+    def __len__(self):
+        return self.rows
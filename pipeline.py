@@ -0,0 +1,147 @@
+import argparse
+import importlib
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+# One entry point for the pipeline scripts. Each subcommand imports its script only when it runs, so quick
+# commands never pay for pandas, matplotlib or the scorers.
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {
+    'combine': 'combine-messages.py',
+    'analyze': 'analyze_sentiment',
+    'visualize': 'visualize_sentiment',
+    'scores': 'score_table'
+}
+FILE_TYPES = ['dm_messages', 'guild_messages', 'all_messages']
+PERIODS = ['day', 'month', 'weekday', 'hour', 'day_hour']
+IMPORT_MARKER = 'pipeline-imports-start'
+
+def run_script(command, argv):
+    """Run one pipeline script with the given arguments, as if it had been started on its own"""
+    script = SCRIPTS[command]
+    if script.endswith('.py'):
+        # Not importable under its file name, run it as __main__ so worker processes can find its functions
+        path = os.path.join(REPO_DIR, script)
+        saved = sys.argv
+        sys.argv = [path] + argv
+        try:
+            runpy.run_path(path, run_name='__main__')
+        finally:
+            sys.argv = saved
+    else:
+        importlib.import_module(script).main(argv)
+
+def import_command(command):
+    # What a subcommand imports before it does any work, timed by the import report
+    script = SCRIPTS.get(command)
+    if script is None:
+        return
+    if script.endswith('.py'):
+        runpy.run_path(os.path.join(REPO_DIR, script), run_name=script[:-3].replace('-', '_'))
+    else:
+        importlib.import_module(script)
+
+def load_overall_stats(file_type, period, source='json'):
+    if source == 'store':
+        from sentiment_store import DEFAULT_STORE_DIR, SUMMARY_FILE
+        with open(os.path.join(DEFAULT_STORE_DIR, SUMMARY_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)['series'][file_type][period]['overall_stats']
+    with open(f'data/sentiment/{file_type}_sentiment_{period}.json', 'r', encoding='utf-8') as f:
+        return json.load(f)['overall_stats']
+
+def print_stats(args):
+    stats = {}
+    for file_type in args.file_type or FILE_TYPES:
+        try:
+            stats[file_type] = load_overall_stats(file_type, args.period, args.input)
+        except (FileNotFoundError, KeyError):
+            print(f"No {file_type} results by {args.period}, run the analyze command first")
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return
+    for file_type, overall in stats.items():
+        print(f"\nResults for {file_type} (by {args.period}):")
+        print(f"Total messages: {overall['message_count']:,}")
+        print(f"Positive messages: {overall['positive_count']:,}")
+        print(f"Negative messages: {overall['negative_count']:,}")
+        print(f"Neutral messages: {overall['neutral_count']:,}")
+        print(f"Average polarity: {overall['average_polarity']:.3f}")
+        print(f"Average subjectivity: {overall['average_subjectivity']:.3f}")
+
+def import_times(command):
+    """Seconds a fresh interpreter spends starting up and loading one subcommand, and the
+    cumulative import time of each top level module it loads, slowest first"""
+    code = (f"import sys; import pipeline; print({IMPORT_MARKER!r}, file=sys.stderr, flush=True); "
+            f"pipeline.import_command({command!r})")
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR,
+                             capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if process.returncode != 0:
+        raise ImportError(process.stderr.strip().splitlines()[-1])
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>package", one space indent is top level
+    modules = {}
+    lines = process.stderr.splitlines()
+    for line in lines[lines.index(IMPORT_MARKER) + 1:]:
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith(' ') and not name.startswith('  ') and cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1e6
+    return seconds, sorted(modules.items(), key=lambda item: item[1], reverse=True)
+
+def print_import_report(commands, top=8):
+    for command in commands:
+        try:
+            seconds, modules = import_times(command)
+        except ImportError as e:
+            print(f"\n{command}: failed to load, {e}")
+            continue
+        print(f"\n{command}: {seconds * 1000:.0f} ms to start, {sum(dict(modules).values()) * 1000:.0f} ms of imports")
+        for name, module_seconds in modules[:top]:
+            print(f"  {module_seconds * 1000:8.1f} ms  {name}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Discord sentiment pipeline: combine, analyze, visualize and inspect')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command, script in SCRIPTS.items():
+        # Everything after the subcommand goes to the script's own parser, see <command> --help
+        commands.add_parser(command, add_help=False, help=f'Run {script}')
+
+    stats = commands.add_parser('stats', help='Print the overall stats of the last analysis')
+    stats.add_argument('--file-type', choices=FILE_TYPES, action='append',
+                       help='Only this file type, can be repeated (default: all)')
+    stats.add_argument('--period', choices=PERIODS, default='day')
+    stats.add_argument('--input', choices=['json', 'store'], default='json',
+                       help='Read the per-period JSON files or the columnar sentiment store')
+    stats.add_argument('--json', action='store_true', help='Print the stats as JSON')
+
+    imports = commands.add_parser('imports', help='Report the startup and import time of each subcommand')
+    imports.add_argument('commands', nargs='*', help='Subcommands to report (default: all)')
+    imports.add_argument('--top', type=int, default=8, help='Modules listed per subcommand')
+
+    args, rest = parser.parse_known_args(argv)
+    if args.command not in SCRIPTS and rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    if args.command == 'imports':
+        unknown = [command for command in args.commands if command not in SCRIPTS and command != 'stats']
+        if unknown:
+            parser.error(f"unknown subcommands: {', '.join(unknown)}")
+    return args, rest
+
+def main(argv=None):
+    args, rest = parse_args(argv)
+    if args.command in SCRIPTS:
+        run_script(args.command, rest)
+    elif args.command == 'stats':
+        print_stats(args)
+    elif args.command == 'imports':
+        print_import_report(args.commands or list(SCRIPTS) + ['stats'], args.top)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import math
+import numpy as np
+
+# Rolling statistics of the time ordered series. Means, deviations and rates of change are reduced window
+# size by window size over strided views of all rows, the EWMA is one pass over the rows for all spans.
+WINDOWS = [7, 14, 30]  # Rolling mean and standard deviation
+ROC_WINDOWS = [1, 7, 30]  # Rate of change, 1 is the plain period to period momentum
+SPANS = [7, 30]  # EWMA, alpha = 2 / (span + 1)
+ROLLING_PERIODS = ['day', 'month']  # The cyclic periods (weekday, hour) have no order to roll over
+ROLLING_COLUMNS = ['average_polarity', 'average_subjectivity', 'total_sentiment_count', 'message_count']
+
+def rolling_path(file_type, period):
+    return f'data/sentiment/{file_type}_rolling_{period}.json'
+
+def rolling_mean_std(values, windows=WINDOWS):
+    """Mean and sample standard deviation over the last w rows for every w, shape (windows, rows).
+    NaN until a window is full, like pandas rolling(w) with its default min_periods."""
+    values = np.asarray(values, dtype=float)
+    mean = np.full((len(windows), len(values)), np.nan)
+    std = np.full((len(windows), len(values)), np.nan)
+    for index, window in enumerate(windows):
+        if window > len(values):
+            continue
+        # Every window on its own, running sums of squares cancel out next to large values
+        view = np.lib.stride_tricks.sliding_window_view(values, window)
+        mean[index, window - 1:] = view.mean(axis=-1)
+        if window > 1:
+            std[index, window - 1:] = view.std(axis=-1, ddof=1)
+    return mean, std
+
+def rate_of_change(values, windows=ROC_WINDOWS):
+    """values[t] - values[t - w] for every w, shape (windows, rows), NaN for the first w rows"""
+    values = np.asarray(values, dtype=float)
+    change = np.full((len(windows), len(values)), np.nan)
+    for index, window in enumerate(windows):
+        if window < len(values):
+            change[index, window:] = values[window:] - values[:-window]
+    return change
+
+def ewma(values, spans=SPANS):
+    """Exponentially weighted moving averages for every span, shape (spans, rows).
+    One pass over the rows updates all spans together, same as pandas ewm(span, adjust=False)."""
+    values = np.asarray(values, dtype=float)
+    alphas = 2.0 / (np.asarray(spans, dtype=float) + 1.0)
+    averages = np.empty((len(spans), len(values)))
+    if len(values) == 0:
+        return averages
+    current = np.full(len(spans), values[0])
+    for row, value in enumerate(values):
+        current = current + alphas * (value - current)
+        averages[:, row] = current
+    return averages
+
+def column_names(windows=WINDOWS, roc_windows=ROC_WINDOWS, spans=SPANS):
+    return ([f'mean_{window}' for window in windows] + [f'std_{window}' for window in windows]
+            + [f'roc_{window}' for window in roc_windows] + [f'ewma_{span}' for span in spans])
+
+def compute_rolling(columns, windows=WINDOWS, roc_windows=ROC_WINDOWS, spans=SPANS):
+    """{series column: {'mean_7': values, 'std_7': ..., 'roc_1': ..., 'ewma_30': ...}} for a time series
+    given as {column: values} in time order. Windows count rows, so days without messages are skipped."""
+    rolling = {}
+    for column in ROLLING_COLUMNS:
+        values = np.asarray(columns[column], dtype=float)
+        mean, std = rolling_mean_std(values, windows)
+        stats = np.concatenate([mean, std, rate_of_change(values, roc_windows), ewma(values, spans)])
+        rolling[column] = dict(zip(column_names(windows, roc_windows, spans), stats))
+    return rolling
+
+def rolling_results(time_series, windows=WINDOWS, roc_windows=ROC_WINDOWS, spans=SPANS):
+    """JSON ready rolling stats of result rows, NaN (window not full yet) becomes null"""
+    columns = {column: [row[column] for row in time_series] for column in ROLLING_COLUMNS}
+    rolling = compute_rolling(columns, windows, roc_windows, spans)
+    return {
+        'windows': windows,
+        'roc_windows': roc_windows,
+        'spans': spans,
+        'dates': [row['date'] for row in time_series],
+        'columns': {
+            column: {name: [None if math.isnan(value) else value for value in values.tolist()]
+                     for name, values in stats.items()}
+            for column, stats in rolling.items()
+        }
+    }
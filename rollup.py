@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from message_store import CHANNEL_TYPES
+from timestamps import format_timestamps, parse_timestamp, period_codes, period_labels
+
+# Hourly sums per channel, every coarser level is derived from these base buckets
+DEFAULT_ROLLUP_PATH = 'data/sentiment/rollup.npz'
+COUNT_COLUMNS = ['messages', 'positive', 'negative', 'neutral']  # messages includes empty ones
+SUM_COLUMNS = ['polarity', 'subjectivity']
+HOUR_BITS = 32  # Row key = channel code << HOUR_BITS | hours since 1970
+UNKNOWN_GUILD = 'unknown'  # Guild of guild channels missing from the channel table, '' is the DMs
+
+# Level -> timestamps period used to derive it from the hour buckets
+LEVELS = {
+    'hour': None,
+    'day': 'day',
+    'week': 'week',
+    'month': 'month',
+    'year': 'year',
+    'weekday': 'weekday',
+    'hour_of_day': 'hour',
+    'weekday_hour': 'day_hour'
+}
+
+def unknown_channel(channel_type):
+    # Stands in for the channel of messages without a ChannelID (combined before channel IDs were kept),
+    # one per type so DMs and guild messages never share a channel
+    return f'unknown-{channel_type}'
+
+class RollupBuilder:
+    """Accumulates (channel, hour) buckets from scored batches, memory grows with the buckets only"""
+
+    def __init__(self, channel_table=None):
+        self.channel_table = channel_table or {}
+        self.channel_codes = {}  # channel ID -> code, in order of first appearance
+        self.channel_ids = []
+        self.channel_types = []
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, len(COUNT_COLUMNS)), dtype=np.int64)
+        self.sums = np.zeros((0, len(SUM_COLUMNS)))
+        self.pending = []
+        self.scorer_version = None  # Of a loaded rollup
+
+    def channel_code(self, channel_id, channel_type):
+        code = self.channel_codes.get(channel_id)
+        if code is None:
+            code = self.channel_codes[channel_id] = len(self.channel_ids)
+            self.channel_ids.append(channel_id)
+            self.channel_types.append(channel_type)
+        return code
+
+    def add_batch(self, channel_type, messages, epochs, polarity, subjectivity):
+        """Add one batch of a single channel type, NaN scores are empty messages"""
+        if len(messages) == 0:
+            return
+        channels = np.array([self.channel_code(message.get('ChannelID') or unknown_channel(channel_type), channel_type)
+                             for message in messages], dtype=np.int64)
+        keys = channels << HOUR_BITS | (np.asarray(epochs, dtype=np.int64) // 3600)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+
+        scored = ~np.isnan(polarity)
+        rows = len(unique)
+        counts = np.stack([
+            np.bincount(inverse, minlength=rows),
+            np.bincount(inverse[scored & (polarity > 0)], minlength=rows),
+            np.bincount(inverse[scored & (polarity < 0)], minlength=rows),
+            np.bincount(inverse[scored & (polarity == 0)], minlength=rows)
+        ], axis=1)
+        sums = np.stack([
+            np.bincount(inverse[scored], weights=polarity[scored], minlength=rows),
+            np.bincount(inverse[scored], weights=subjectivity[scored], minlength=rows)
+        ], axis=1)
+        self.pending.append((unique, counts, sums))
+        if len(self.pending) >= 64:
+            self.compact()
+
+    def compact(self):
+        # Fold the pending batches into the sorted bucket arrays
+        if not self.pending:
+            return
+        keys = np.concatenate([self.keys] + [keys for keys, _, _ in self.pending])
+        counts = np.concatenate([self.counts] + [counts for _, counts, _ in self.pending])
+        sums = np.concatenate([self.sums] + [sums for _, _, sums in self.pending])
+        self.pending = []
+
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+        self.counts = np.zeros((len(self.keys), len(COUNT_COLUMNS)), dtype=np.int64)
+        self.sums = np.zeros((len(self.keys), len(SUM_COLUMNS)))
+        np.add.at(self.counts, inverse, counts)
+        np.add.at(self.sums, inverse, sums)
+
+    def arrays(self, scorer_version=None):
+        # What save writes and RollupIndex reads
+        self.compact()
+        guild_ids = [(self.channel_table.get(channel_id) or {}).get('guild_id')
+                     or (UNKNOWN_GUILD if channel_type == 'Guild' else '')
+                     for channel_id, channel_type in zip(self.channel_ids, self.channel_types)]
+        meta = {
+            'scorer_version': scorer_version,
+            'count_columns': COUNT_COLUMNS,
+            'sum_columns': SUM_COLUMNS,
+            'channel_types': CHANNEL_TYPES
+        }
+        return {
+            'keys': self.keys,
+            'counts': self.counts,
+            'sums': self.sums,
+            'channel_ids': np.array(self.channel_ids, dtype=str),
+            'channel_types': np.array([CHANNEL_TYPES.index(channel_type) for channel_type in self.channel_types],
+                                      dtype=np.int8),
+            'guild_ids': np.array(guild_ids, dtype=str),
+            'meta': np.array(json.dumps(meta))
+        }
+
+    def save(self, path=DEFAULT_ROLLUP_PATH, scorer_version=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **self.arrays(scorer_version))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_ROLLUP_PATH, channel_table=None):
+        """Continue a saved rollup, for incremental runs"""
+        builder = cls(channel_table)
+        with np.load(path, allow_pickle=False) as data:
+            builder.keys = data['keys']
+            builder.counts = data['counts']
+            builder.sums = data['sums']
+            builder.channel_ids = data['channel_ids'].tolist()
+            builder.channel_types = [CHANNEL_TYPES[code] for code in data['channel_types'].tolist()]
+            builder.scorer_version = json.loads(data['meta'].item())['scorer_version']
+        builder.channel_codes = {channel_id: code for code, channel_id in enumerate(builder.channel_ids)}
+        return builder
+
+def to_epoch(value):
+    # Query bounds as epoch seconds, 'YYYY-MM-DD[ HH:MM:SS]' strings or numbers
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return parse_timestamp(value)
+
+def bucket_stats(counts, sums):
+    # Same fields as the analysis results, averages over the scored messages
+    scored = counts[..., 1] + counts[..., 2] + counts[..., 3]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_polarity = np.where(scored > 0, sums[..., 0] / scored, 0.0)
+        average_subjectivity = np.where(scored > 0, sums[..., 1] / scored, 0.0)
+    return {
+        'message_count': counts[..., 0],
+        'scored_count': scored,
+        'positive_count': counts[..., 1],
+        'negative_count': counts[..., 2],
+        'neutral_count': counts[..., 3],
+        'total_sentiment_count': counts[..., 1] - counts[..., 2],
+        'average_polarity': average_polarity,
+        'average_subjectivity': average_subjectivity
+    }
+
+class RollupIndex:
+    """Range, series and group-by queries over a saved rollup, answered from precomputed sums"""
+
+    def __init__(self, path=DEFAULT_ROLLUP_PATH, data=None):
+        # data: the arrays of a rollup still in memory, see from_builder
+        if data is None:
+            with np.load(path, allow_pickle=False) as arrays:
+                data = {name: arrays[name] for name in arrays.files}
+        self.keys = data['keys']
+        counts = data['counts']
+        sums = data['sums']
+        self.channel_ids = data['channel_ids']
+        self.channel_types = data['channel_types']
+        self.guild_ids = data['guild_ids']
+        self.meta = json.loads(data['meta'].item())
+        self.path = path
+        self.channels = self.keys >> HOUR_BITS
+        self.hours = self.keys & ((1 << HOUR_BITS) - 1)
+        self.counts = counts
+        self.sums = sums
+
+        # Prefix sums along the key order, a channel's hour range is a contiguous slice
+        self.counts_prefix = np.vstack([np.zeros((1, counts.shape[1]), dtype=np.int64), np.cumsum(counts, axis=0)])
+        self.sums_prefix = np.vstack([np.zeros((1, sums.shape[1])), np.cumsum(sums, axis=0)])
+        self.channel_codes = {channel_id: code for code, channel_id in enumerate(self.channel_ids.tolist())}
+
+    @classmethod
+    def from_builder(cls, builder):
+        """Query a rollup while it is built, without writing it out first"""
+        return cls(None, builder.arrays(builder.scorer_version))
+
+    def select_channels(self, channel_type=None, guild=None, channels=None):
+        """Channel codes matching every given filter"""
+        selected = np.ones(len(self.channel_ids), dtype=bool)
+        if channel_type is not None:
+            selected &= self.channel_types == CHANNEL_TYPES.index(channel_type)
+        if guild is not None:
+            selected &= self.guild_ids == str(guild)
+        if channels is not None:
+            wanted = np.zeros(len(self.channel_ids), dtype=bool)
+            wanted[[self.channel_codes[str(channel)] for channel in channels if str(channel) in self.channel_codes]] = True
+            selected &= wanted
+        return np.flatnonzero(selected)
+
+    def hour_bounds(self, start=None, end=None):
+        # [first hour, last hour) covering the range, bounds snap to whole hours
+        start, end = to_epoch(start), to_epoch(end)
+        first = 0 if start is None else start // 3600
+        last = (1 << HOUR_BITS) - 1 if end is None else -(-end // 3600)
+        return first, last
+
+    def channel_slices(self, codes, start=None, end=None):
+        first, last = self.hour_bounds(start, end)
+        codes = np.asarray(codes, dtype=np.int64)
+        lo = np.searchsorted(self.keys, codes << HOUR_BITS | first)
+        hi = np.searchsorted(self.keys, codes << HOUR_BITS | last)
+        return lo, hi
+
+    def totals(self, start=None, end=None, **filters):
+        """Overall stats for a time range, two binary searches per selected channel"""
+        lo, hi = self.channel_slices(self.select_channels(**filters), start, end)
+        counts = (self.counts_prefix[hi] - self.counts_prefix[lo]).sum(axis=0)
+        sums = (self.sums_prefix[hi] - self.sums_prefix[lo]).sum(axis=0)
+        return {name: value.item() for name, value in bucket_stats(counts, sums).items()}
+
+    def channel_groups(self, by, codes):
+        # Group of each channel code: its ID, its guild's ID ('' for DMs) or its type
+        if by == 'channel':
+            return self.channel_ids[codes]
+        elif by == 'guild':
+            return self.guild_ids[codes]
+        elif by == 'channel_type':
+            return np.array(CHANNEL_TYPES)[self.channel_types[codes]]
+        raise ValueError(f"Unknown grouping: {by}")
+
+    def group_totals(self, by='channel', start=None, end=None, **filters):
+        """Stats per channel, guild or channel type for a time range, as {group: stats}"""
+        codes = self.select_channels(**filters)
+        lo, hi = self.channel_slices(codes, start, end)
+        counts = self.counts_prefix[hi] - self.counts_prefix[lo]
+        sums = self.sums_prefix[hi] - self.sums_prefix[lo]
+
+        names, inverse = np.unique(self.channel_groups(by, codes), return_inverse=True)
+        group_counts = np.zeros((len(names), counts.shape[1]), dtype=np.int64)
+        group_sums = np.zeros((len(names), sums.shape[1]))
+        np.add.at(group_counts, inverse.ravel(), counts)
+        np.add.at(group_sums, inverse.ravel(), sums)
+
+        stats = bucket_stats(group_counts, group_sums)
+        return {name: {field: values[index].item() for field, values in stats.items()}
+                for index, name in enumerate(names.tolist()) if group_counts[index, 0] > 0}
+
+    def selected_rows(self, level, start, end, filters):
+        # Bucket rows inside the range and filters, with their period code at the level
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level: {level}")
+        first, last = self.hour_bounds(start, end)
+        selected = np.zeros(len(self.channel_ids), dtype=bool)
+        selected[self.select_channels(**filters)] = True
+        rows = np.flatnonzero(selected[self.channels] & (self.hours >= first) & (self.hours < last))
+
+        hours = self.hours[rows]
+        period = LEVELS[level]
+        return rows, hours if period is None else period_codes(hours * 3600, period)
+
+    def series(self, level='day', start=None, end=None, **filters):
+        """Time series at any level derived from the hour buckets, rows like the analysis results"""
+        rows, codes = self.selected_rows(level, start, end, filters)
+        unique, inverse = np.unique(codes, return_inverse=True)
+        inverse = inverse.ravel()
+        counts = np.zeros((len(unique), self.counts.shape[1]), dtype=np.int64)
+        sums = np.zeros((len(unique), self.sums.shape[1]))
+        np.add.at(counts, inverse, self.counts[rows])
+        np.add.at(sums, inverse, self.sums[rows])
+        return series_rows(unique, LEVELS[level], counts, sums)
+
+    def group_series(self, by='channel', level='day', start=None, end=None, groups=None, **filters):
+        """Time series of every group at once as {group: rows}, one pass over the bucket rows.
+        groups limits the output to these group names, e.g. the top few by messages."""
+        rows, codes = self.selected_rows(level, start, end, filters)
+        names, group_of = np.unique(self.channel_groups(by, self.channels[rows]), return_inverse=True)
+        group_of = group_of.ravel()
+        if groups is not None:
+            keep = np.isin(names, [str(group) for group in groups])[group_of]
+            rows, codes, group_of = rows[keep], codes[keep], group_of[keep]
+
+        # (group, period) pairs sort group first, so each group's rows are one slice in period order
+        pairs, inverse = np.unique(np.stack([group_of, codes], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        counts = np.zeros((len(pairs), self.counts.shape[1]), dtype=np.int64)
+        sums = np.zeros((len(pairs), self.sums.shape[1]))
+        np.add.at(counts, inverse, self.counts[rows])
+        np.add.at(sums, inverse, self.sums[rows])
+
+        result = {}
+        bounds = np.searchsorted(pairs[:, 0], np.arange(len(names) + 1))
+        for index, name in enumerate(names.tolist()):
+            lo, hi = bounds[index], bounds[index + 1]
+            if hi > lo:
+                result[name] = series_rows(pairs[lo:hi, 1], LEVELS[level], counts[lo:hi], sums[lo:hi])
+        return result
+
+def series_rows(codes, period, counts, sums):
+    # Rows like the analysis results from period codes and their bucket sums
+    if period is None:
+        labels = [timestamp[:13] + ':00' for timestamp in format_timestamps(codes * 3600)]
+    else:
+        labels = period_labels(codes, period)
+    stats = {name: values.tolist() for name, values in bucket_stats(counts, sums).items()}
+    series = []
+    for index, label in enumerate(labels):
+        row = label if isinstance(label, dict) else {'date': label}
+        series.append({**row, **{name: values[index] for name, values in stats.items()}})
+    return series
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Query the sentiment rollup written by analyze_sentiment --rollup')
+    parser.add_argument('--rollup', default=DEFAULT_ROLLUP_PATH, help='Path of the rollup file')
+    parser.add_argument('--level', choices=list(LEVELS), help='Print a time series at this level')
+    parser.add_argument('--group-by', choices=['channel', 'guild', 'channel_type'],
+                        help='Print totals per group instead of a time series')
+    parser.add_argument('--start', help="Inclusive start, 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument('--end', help="Exclusive end, 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument('--type', choices=CHANNEL_TYPES, help='Only DMs or only guild channels')
+    parser.add_argument('--guild', help='Only the channels of this guild ID')
+    parser.add_argument('--channel', action='append', help='Only this channel ID, can be repeated')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    index = RollupIndex(args.rollup)
+    loaded = time.perf_counter()
+
+    filters = {'channel_type': args.type, 'guild': args.guild, 'channels': args.channel}
+    if args.group_by:
+        result = index.group_totals(args.group_by, args.start, args.end, **filters)
+    elif args.level:
+        result = index.series(args.level, args.start, args.end, **filters)
+    else:
+        result = index.totals(args.start, args.end, **filters)
+    finished = time.perf_counter()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"Loaded {len(index.keys):,} buckets in {(loaded - started) * 1000:.1f} ms, "
+          f"answered in {(finished - loaded) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
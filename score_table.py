@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from breakdown import group_info
+from message_store import CHANNELS_PATH, DEFAULT_STORE_PATH, MessageStore, load_channel_table
+from timestamps import format_timestamps, parse_timestamp
+
+# Column name -> dtype, each column is one raw little-endian file. 28 bytes a message, channel is an index
+# into the channel IDs listed in meta.json.
+COLUMNS = {
+    'id': '<i8',
+    'timestamp': '<i8',
+    'polarity': '<f4',
+    'subjectivity': '<f4',
+    'channel': '<i4'
+}
+# --most choice -> (column, lowest first)
+EXTREMES = {
+    'negative': ('polarity', True),
+    'positive': ('polarity', False),
+    'objective': ('subjectivity', True),
+    'subjective': ('subjectivity', False)
+}
+
+class ScoreTableWriter:
+    """Streams per-message scores to disk column by column"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.count = 0
+        self.channel_codes = {}  # channel ID (None when unknown) -> code, in order of first appearance
+        self.channel_ids = []
+        self.last_timestamp = None
+        self.sorted = True
+        self.files = {name: open(os.path.join(directory, f'{name}.bin'), 'wb') for name in COLUMNS}
+
+    def channel_code(self, channel_id):
+        code = self.channel_codes.get(channel_id)
+        if code is None:
+            code = self.channel_codes[channel_id] = len(self.channel_ids)
+            self.channel_ids.append(channel_id)
+        return code
+
+    def append_batch(self, messages, epochs, polarity, subjectivity):
+        # Only scored rows are kept, empty messages have NaN scores
+        scored = ~np.isnan(polarity)
+        columns = {
+            'id': np.array([int(message['ID']) for message in messages], dtype=np.int64)[scored],
+            'timestamp': np.asarray(epochs, dtype=np.int64)[scored],
+            'polarity': polarity[scored],
+            'subjectivity': subjectivity[scored],
+            'channel': np.array([self.channel_code(message.get('ChannelID') or None) for message in messages],
+                                dtype=np.int64)[scored]
+        }
+        for name, dtype in COLUMNS.items():
+            columns[name].astype(dtype).tofile(self.files[name])
+        self.count += int(scored.sum())
+
+        # Date range queries binary search the timestamps when the rows arrived in time order
+        timestamps = columns['timestamp']
+        if len(timestamps):
+            if self.last_timestamp is not None and timestamps[0] < self.last_timestamp:
+                self.sorted = False
+            self.sorted = self.sorted and bool(np.all(timestamps[1:] >= timestamps[:-1]))
+            self.last_timestamp = int(timestamps[-1])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+        meta = {
+            'rows': self.count,
+            'columns': COLUMNS,
+            'sorted': self.sorted,
+            'channels': self.channel_ids
+        }
+        with open(os.path.join(self.directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+def load_score_table(directory):
+    """Memory-map every column of a table written by ScoreTableWriter"""
+    with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    table = {}
+    for name, dtype in meta['columns'].items():
+        path = os.path.join(directory, f'{name}.bin')
+        if meta['rows'] == 0:
+            table[name] = np.zeros(0, dtype=dtype)
+        else:
+            table[name] = np.memmap(path, dtype=dtype, mode='r', shape=(meta['rows'],))
+    return table
+
+class ScoreTable:
+    """Queries over a memory-mapped score table, only the rows a query touches are read"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.columns = load_score_table(directory)
+        self.rows = self.meta['rows']
+        # Tables written before the channel column have neither of these
+        self.channel_ids = self.meta.get('channels', [])
+        self.sorted = self.meta.get('sorted', False)
+
+    def __len__(self):
+        return self.rows
+
+    def select(self, start=None, end=None, channels=None):
+        """Row numbers with start <= timestamp < end, optionally only in the given channel IDs"""
+        timestamps = self.columns['timestamp']
+        start = parse_timestamp(start) if isinstance(start, str) else start
+        end = parse_timestamp(end) if isinstance(end, str) else end
+        if self.sorted:
+            first = np.searchsorted(timestamps, start, 'left') if start is not None else 0
+            last = np.searchsorted(timestamps, end, 'left') if end is not None else self.rows
+            rows = np.arange(first, last)
+        else:
+            keep = np.ones(self.rows, dtype=bool)
+            if start is not None:
+                keep &= timestamps >= start
+            if end is not None:
+                keep &= timestamps < end
+            rows = np.flatnonzero(keep)
+
+        if channels is not None:
+            if 'channel' not in self.columns:
+                raise ValueError("This score table has no channel column, write it again with analyze --scores-out")
+            wanted = set(channels)
+            codes = [code for code, channel_id in enumerate(self.channel_ids) if channel_id in wanted]
+            rows = rows[np.isin(self.columns['channel'][rows], codes)]
+        return rows
+
+    def extremes(self, column='polarity', top=10, lowest=True, **filters):
+        """Rows with the top lowest (or highest) scores, ties in table order"""
+        rows = self.select(**filters)
+        if top <= 0:
+            return rows[:0]
+        values = np.asarray(self.columns[column][rows], dtype=np.float64)
+        if not lowest:
+            values = -values
+        if top < len(rows):
+            # Partition first, only the top rows get sorted
+            candidates = np.argpartition(values, top - 1)[:top]
+            candidates = candidates[np.lexsort((candidates, values[candidates]))]
+        else:
+            candidates = np.lexsort((np.arange(len(rows)), values))
+        return rows[candidates]
+
+    def summary(self, **filters):
+        """Counts and averages over the scored rows, empty messages are not kept in the table"""
+        rows = self.select(**filters)
+        polarity = np.asarray(self.columns['polarity'][rows], dtype=np.float64)
+        subjectivity = np.asarray(self.columns['subjectivity'][rows], dtype=np.float64)
+        return {
+            'scored_count': len(rows),
+            'positive_count': int(np.sum(polarity > 0)),
+            'negative_count': int(np.sum(polarity < 0)),
+            'neutral_count': int(np.sum(polarity == 0)),
+            'average_polarity': float(polarity.mean()) if len(rows) else 0.0,
+            'average_subjectivity': float(subjectivity.mean()) if len(rows) else 0.0
+        }
+
+    def records(self, rows):
+        """Plain dicts of the given rows, scores rounded to the float32 precision they were kept at"""
+        rows = np.asarray(rows, dtype=np.int64)
+        channels = self.columns['channel'][rows].tolist() if 'channel' in self.columns else [None] * len(rows)
+        return [{
+            'id': str(message_id),
+            'timestamp': timestamp,
+            'channel_id': self.channel_ids[channel] if channel is not None else None,
+            'polarity': round(polarity, 6),
+            'subjectivity': round(subjectivity, 6)
+        } for message_id, timestamp, channel, polarity, subjectivity in zip(
+            self.columns['id'][rows].tolist(), format_timestamps(self.columns['timestamp'][rows]), channels,
+            self.columns['polarity'][rows].tolist(), self.columns['subjectivity'][rows].tolist())]
+
+def attach_contents(records, store):
+    # Message texts from the columnar message store, looked up by ID
+    ids = np.array([int(record['id']) for record in records], dtype=np.int64)
+    rows = np.flatnonzero(np.isin(store.id, ids))
+    texts = {int(store.id[row]): store.text('Contents', row) for row in rows.tolist()}
+    for record in records:
+        record['contents'] = texts.get(int(record['id']))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Query a per-message score table written by analyze_sentiment --scores-out')
+    parser.add_argument('table', help='Table directory, e.g. data/scores/all_messages')
+    parser.add_argument('--most', choices=list(EXTREMES), default='negative', help='Which messages to list')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--start', help="Inclusive start, 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument('--end', help="Exclusive end, 'YYYY-MM-DD[ HH:MM:SS]'")
+    parser.add_argument('--channel', action='append', help='Only this channel ID, can be repeated')
+    parser.add_argument('--contents', action='store_true',
+                        help=f'Also print the message texts, read from the message store at {DEFAULT_STORE_PATH}')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    table = ScoreTable(args.table)
+    loaded = time.perf_counter()
+
+    filters = {'start': args.start, 'end': args.end, 'channels': args.channel}
+    column, lowest = EXTREMES[args.most]
+    summary = table.summary(**filters)
+    records = table.records(table.extremes(column, args.top, lowest, **filters))
+    finished = time.perf_counter()
+
+    if args.contents:
+        try:
+            attach_contents(records, MessageStore(DEFAULT_STORE_PATH))
+        except FileNotFoundError:
+            print(f"Message store not found: {DEFAULT_STORE_PATH}, run combine-messages.py --format store")
+
+    if args.json:
+        print(json.dumps({'summary': summary, 'messages': records}, indent=2, ensure_ascii=False))
+    else:
+        channel_table = load_channel_table(CHANNELS_PATH)
+        print(f"{summary['scored_count']:,} scored messages, average polarity {summary['average_polarity']:+.3f}")
+        print(f"\nMost {args.most}:")
+        for record in records:
+            if record['channel_id'] is None:
+                channel = 'unknown channel'  # Combined before channel IDs were kept
+            else:
+                channel = group_info('channel', record['channel_id'], channel_table)['name']
+            print(f"  {record['timestamp']}  {record['polarity']:+.3f} polarity  {record['subjectivity']:.3f} "
+                  f"subjectivity  {channel:<20} {record['id']}")
+            if record.get('contents') is not None:
+                print(f"      {record['contents'][:200]}")
+    print(f"Opened {table.rows:,} rows in {(loaded - started) * 1000:.1f} ms, "
+          f"answered in {(finished - loaded) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
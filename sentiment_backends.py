@@ -0,0 +1,206 @@
+import argparse
+import re
+import time
+from importlib.metadata import version
+import numpy as np
+
+# Scorers take a batch of texts and return (polarity, subjectivity) float64 arrays
+
+class TextBlobScorer:
+    """Reference backend, TextBlob's pattern analyzer one text at a time"""
+
+    name = 'textblob'
+
+    def __init__(self):
+        from textblob import TextBlob
+
+        self.TextBlob = TextBlob
+        self.version = f"textblob-{version('textblob')}"
+
+    def score_batch(self, texts):
+        polarity = np.empty(len(texts))
+        subjectivity = np.empty(len(texts))
+        for index, text in enumerate(texts):
+            sentiment = self.TextBlob(text).sentiment
+            polarity[index] = sentiment.polarity
+            subjectivity[index] = sentiment.subjectivity
+        return polarity, subjectivity
+
+class LexiconScorer:
+    """TextBlob's pattern lexicon compiled into a flat token table, scored after one regex tokenization.
+    Follows pattern's assessment rules (modifiers, negations, '!' and emoticons) but not its
+    tokenizer exactly, see parity_report for the drift."""
+
+    name = 'lexicon'
+    NEGATIONS = frozenset(("no", "not", "n't", "never"))
+
+    def __init__(self):
+        from textblob.en import sentiment as lexicon
+        from textblob._text import EMOTICONS, PUNCTUATION
+
+        if dict.__len__(lexicon) == 0:
+            lexicon.load()
+
+        # word -> (polarity, subjectivity, intensity, can modify the next word)
+        self.table = {}
+        for word, senses in dict.items(lexicon):
+            if None in senses:
+                polarity, subjectivity, intensity = senses[None][:3]
+                self.table[word] = (polarity, subjectivity, intensity,
+                                    any(tag in senses for tag in lexicon.modifiers))
+
+        # Lowercased emoticon -> polarity, the first matching mood wins like in pattern
+        self.emoticons = {}
+        for (_, polarity), faces in EMOTICONS.items():
+            for face in faces:
+                self.emoticons.setdefault(face.lower(), polarity)
+        self.punctuation = PUNCTUATION
+
+        faces = sorted(self.emoticons, key=len, reverse=True)
+        self.tokenizer = re.compile(
+            r"\(\s?!\s?\)"  # Sarcasm "(!)"
+            r"|(?:%s)(?=\s|$)"  # Emoticons followed by a space or the end
+            r"|\.\.\.|!"
+            r"|[^\W_]+(?:[-.][^\W_]+)*" % "|".join(re.escape(face) for face in faces)
+        )
+        self.version = f"lexicon-1-textblob-{version('textblob')}"
+
+    def tokenize(self, text):
+        # pattern splits "don't" into "do n ' t", splitting "n't" off keeps the same token lengths
+        text = text.lower().replace("n't", " n't")
+        return ['(!)' if token[0] == '(' else token for token in self.tokenizer.findall(text)]
+
+    def score_tokens(self, tokens):
+        table = self.table
+        negations = self.NEGATIONS
+        assessments = []  # [polarity, subjectivity, intensity, negated]
+        modifier = None
+        negation = None
+
+        for word in tokens:
+            entry = table.get(word)
+            if entry is not None:
+                polarity, subjectivity, intensity, modifies = entry
+                if modifier is None:
+                    assessments.append([polarity, subjectivity, intensity, False])
+                else:
+                    # "really good", the modifier's intensity scales the word
+                    last = assessments[-1]
+                    last[0] = max(-1.0, min(polarity * last[2], +1.0))
+                    last[1] = max(-1.0, min(subjectivity * last[2], +1.0))
+                    last[2] = intensity
+                if negation is not None:
+                    assessments[-1][2] = 1.0 / assessments[-1][2]
+                    assessments[-1][3] = True
+                modifier = word if modifies else None
+                negation = word if word in negations else None
+            else:
+                if word in negations:
+                    negation = word
+                elif negation and len(word.strip("'")) > 1:
+                    negation = None
+                if negation is not None and modifier is not None and modifier.endswith('ly'):
+                    assessments[-1][3] = True
+                    negation = None
+                elif modifier and len(word) > 2:
+                    modifier = None
+                if word == '!' and assessments:
+                    assessments[-1][0] = max(-1.0, min(assessments[-1][0] * 1.25, +1.0))
+                if word == '(!)':
+                    assessments.append([0.0, 1.0, 1.0, False])
+                if not word.isalpha() and len(word) <= 5 and word not in self.punctuation:
+                    polarity = self.emoticons.get(word)
+                    if polarity is not None:
+                        assessments.append([polarity, 1.0, 1.0, False])
+
+        if not assessments:
+            return 0.0, 0.0
+        # "not good" = slightly bad, "not bad" = slightly good
+        total_polarity = 0
+        total_subjectivity = 0
+        for polarity, subjectivity, _, negated in assessments:
+            total_polarity += polarity * -0.5 if negated else polarity
+            total_subjectivity += subjectivity
+        return total_polarity / float(len(assessments)), total_subjectivity / float(len(assessments))
+
+    def score_batch(self, texts):
+        polarity = np.empty(len(texts))
+        subjectivity = np.empty(len(texts))
+        for index, text in enumerate(texts):
+            polarity[index], subjectivity[index] = self.score_tokens(self.tokenize(text))
+        return polarity, subjectivity
+
+BACKENDS = {
+    'textblob': TextBlobScorer,
+    'lexicon': LexiconScorer
+}
+_scorers = {}
+
+def get_scorer(name='textblob'):
+    # One instance per process, building the lexicon table is not free
+    if name not in _scorers:
+        _scorers[name] = BACKENDS[name]()
+    return _scorers[name]
+
+def parity_report(texts, backend='lexicon', reference='textblob', worst=10):
+    """How far a backend's scores drift from the reference on the same texts"""
+    results = {}
+    for name in (reference, backend):
+        scorer = get_scorer(name)
+        started = time.perf_counter()
+        results[name] = scorer.score_batch(texts)
+        elapsed = time.perf_counter() - started
+        results[name + '_texts_per_second'] = len(texts) / elapsed if elapsed > 0 else 0
+
+    reference_polarity, reference_subjectivity = results[reference]
+    polarity, subjectivity = results[backend]
+    polarity_error = np.abs(polarity - reference_polarity)
+    subjectivity_error = np.abs(subjectivity - reference_subjectivity)
+    worst_rows = np.argsort(-polarity_error, kind='stable')[:worst]
+
+    return {
+        'texts': len(texts),
+        'backend': backend,
+        'reference': reference,
+        'speedup': results[backend + '_texts_per_second'] / max(results[reference + '_texts_per_second'], 1e-9),
+        'texts_per_second': {name: results[name + '_texts_per_second'] for name in (reference, backend)},
+        'polarity_exact_share': float(np.mean(polarity_error < 1e-9)) if len(texts) else 1.0,
+        'polarity_mean_abs_error': float(polarity_error.mean()) if len(texts) else 0.0,
+        'polarity_max_abs_error': float(polarity_error.max()) if len(texts) else 0.0,
+        'subjectivity_mean_abs_error': float(subjectivity_error.mean()) if len(texts) else 0.0,
+        'label_agreement': float(np.mean(np.sign(polarity) == np.sign(reference_polarity))) if len(texts) else 1.0,
+        'worst': [{'text': texts[row],
+                   reference: float(reference_polarity[row]),
+                   backend: float(polarity[row])} for row in worst_rows.tolist()]
+    }
+
+def print_parity_report(report):
+    print(f"Parity of {report['backend']} against {report['reference']} on {report['texts']:,} texts")
+    for name, rate in report['texts_per_second'].items():
+        print(f"  {name}: {rate:,.0f} texts/s")
+    print(f"  Speedup: {report['speedup']:.1f}x")
+    print(f"  Identical polarity: {report['polarity_exact_share']:.2%}")
+    print(f"  Same positive/negative/neutral label: {report['label_agreement']:.2%}")
+    print(f"  Polarity error: mean {report['polarity_mean_abs_error']:.4f}, max {report['polarity_max_abs_error']:.4f}")
+    print(f"  Subjectivity error: mean {report['subjectivity_mean_abs_error']:.4f}")
+    print("  Largest polarity differences:")
+    for row in report['worst']:
+        print(f"    {row[report['reference']]:+.3f} vs {row[report['backend']]:+.3f}  {row['text'][:80]!r}")
+
+if __name__ == '__main__':
+    from json_stream import iter_json_array
+
+    parser = argparse.ArgumentParser(description='Compare a sentiment backend against the TextBlob reference')
+    parser.add_argument('messages', nargs='?', default='data/raw/all_messages.json',
+                        help='Combined messages JSON to sample texts from')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='lexicon')
+    parser.add_argument('--limit', type=int, default=20000, help='Number of non-empty messages to compare')
+    args = parser.parse_args()
+
+    texts = []
+    for message in iter_json_array(args.messages):
+        if message['Contents']:
+            texts.append(message['Contents'])
+            if len(texts) >= args.limit:
+                break
+    print_parity_report(parity_report(texts, args.backend))
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sqlite3
+
+DEFAULT_CACHE_PATH = 'data/cache/sentiment_cache.sqlite'
+
+def content_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+class SentimentCache:
+    """On-disk sentiment scores keyed by message ID, content hash and scorer version"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, scorer_version='default'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        self.path = path
+        self.scorer_version = scorer_version
+        self.hits = 0
+        self.misses = 0
+        self.pending = []
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS scores ('
+            'message_id TEXT NOT NULL, '
+            'content_hash BLOB NOT NULL, '
+            'scorer TEXT NOT NULL, '
+            'polarity REAL NOT NULL, '
+            'subjectivity REAL NOT NULL, '
+            'PRIMARY KEY (message_id, content_hash, scorer)'
+            ') WITHOUT ROWID'
+        )
+
+    def get(self, message):
+        row = self.conn.execute(
+            'SELECT polarity, subjectivity FROM scores '
+            'WHERE message_id = ? AND content_hash = ? AND scorer = ?',
+            (str(message['ID']), content_hash(message['Contents']), self.scorer_version)
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def put(self, message, polarity, subjectivity, flush_every=10000):
+        self.pending.append((str(message['ID']), content_hash(message['Contents']),
+                             self.scorer_version, polarity, subjectivity))
+        if len(self.pending) >= flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)', self.pending)
+            self.pending = []
+
+    def invalidate(self, all_versions=False):
+        # Drop cached scores for this scorer version (or every version)
+        self.pending = []
+        with self.conn:
+            if all_versions:
+                deleted = self.conn.execute('DELETE FROM scores').rowcount
+            else:
+                deleted = self.conn.execute('DELETE FROM scores WHERE scorer = ?',
+                                            (self.scorer_version,)).rowcount
+        self.conn.execute('VACUUM')
+        return deleted
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self.conn.execute('SELECT COUNT(*) FROM scores WHERE scorer = ?',
+                                    (self.scorer_version,)).fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0,
+            'entries': entries,
+            'size_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        }
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import bisect
+import collections
+import glob
+import json
+import os
+import signal
+import time
+from urllib.parse import parse_qsl, urlsplit
+import numpy as np
+from breakdown import group_info
+from message_store import CHANNELS_PATH, FILE_TYPE_FILTERS, load_channel_table
+from rollup import DEFAULT_ROLLUP_PATH, RollupIndex, bucket_stats
+from sentiment_store import DEFAULT_STORE_DIR, SUMMARY_FILE, VALUE_COLUMNS, SentimentStore
+from timestamps import parse_timestamp
+
+# Local HTTP queries over the analysis output, everything is held in memory and swapped whole on reload
+FILE_TYPES = list(FILE_TYPE_FILTERS)
+PERIODS = ['day', 'month', 'weekday', 'hour', 'day_hour']
+RANGE_PERIODS = ['day', 'month']  # Labels sort by time, the other periods are cyclic
+DEFAULT_PORT = 8765
+CACHE_SIZE = 1024  # Responses kept, least recently used go first
+LATENCY_WINDOW = 10000  # Requests per route the percentiles are taken over
+
+JSON_TYPE = 'application/json; charset=utf-8'
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class SentimentData:
+    """Time series by (file type, period) as columns, plus the rollup for group-by queries"""
+
+    def __init__(self, source='json', directory=DEFAULT_STORE_DIR, rollup_path=DEFAULT_ROLLUP_PATH):
+        self.series = {}
+        self.overall = {}
+        self.rolling = {}
+        if source == 'store':
+            store = SentimentStore(directory)
+            for file_type, periods in store.summary['series'].items():
+                for period in periods:
+                    results = store.results(file_type, period)
+                    self.add(file_type, period, results['overall_stats'], results['time_series'],
+                             results.get('rolling'))
+        else:
+            for file_type in FILE_TYPES:
+                for period in PERIODS:
+                    path = os.path.join(directory, f'{file_type}_sentiment_{period}.json')
+                    if os.path.exists(path):
+                        with open(path, 'r', encoding='utf-8') as f:
+                            results = json.load(f)
+                        rows = results['time_series']
+                        columns = {name: [row[name] for row in rows] for name in (rows[0] if rows else {})}
+                        rolling = None
+                        rolling_file = os.path.join(directory, f'{file_type}_rolling_{period}.json')
+                        if os.path.exists(rolling_file):
+                            with open(rolling_file, 'r', encoding='utf-8') as f:
+                                rolling = json.load(f)
+                        self.add(file_type, period, results['overall_stats'], columns, rolling)
+
+        self.rollup = RollupIndex(rollup_path) if os.path.exists(rollup_path) else None
+        self.channel_table = load_channel_table(CHANNELS_PATH)
+
+    def add(self, file_type, period, overall_stats, columns, rolling=None):
+        # Numbers as arrays for range sums, labels as lists for bisect
+        self.series[file_type, period] = {
+            name: values if name not in VALUE_COLUMNS else np.asarray(values, dtype=VALUE_COLUMNS[name])
+            for name, values in columns.items()
+        }
+        self.overall[file_type, period] = overall_stats
+        if rolling is not None:
+            # Rows line up with the series rows, null becomes NaN
+            self.rolling[file_type, period] = {
+                column: {name: np.asarray(values, dtype=float) for name, values in stats.items()}
+                for column, stats in rolling['columns'].items()
+            }
+
+    def entry(self, file_type, period):
+        if (file_type, period) not in self.series:
+            raise QueryError(404, f"No {file_type}/{period} results, run analyze_sentiment first")
+        return self.series[file_type, period]
+
+    def row_range(self, columns, period, start, end):
+        # [lo, hi) of the rows inside the range, bounds are cut to the label length ('2020-03' for months)
+        if start is None and end is None:
+            return 0, len(next(iter(columns.values()), []))
+        if period not in RANGE_PERIODS:
+            raise QueryError(400, f"start/end need a period of {' or '.join(RANGE_PERIODS)}")
+        for name, bound in (('start', start), ('end', end)):
+            # Checked before they are cut, the label comparison would take anything
+            if bound is not None:
+                try:
+                    parse_timestamp(bound)
+                except ValueError:
+                    raise QueryError(400, f"Invalid {name} {bound}, expected 'YYYY-MM-DD[ HH:MM:SS]'") from None
+        labels = columns['date']
+        width = 10 if period == 'day' else 7
+        lo = 0 if start is None else bisect.bisect_left(labels, start[:width])
+        hi = len(labels) if end is None else bisect.bisect_left(labels, end[:width])
+        return lo, max(lo, hi)
+
+def file_type_param(params):
+    file_type = params.get('file_type', 'all_messages')
+    if file_type not in FILE_TYPE_FILTERS:
+        raise QueryError(400, f"Unknown file_type {file_type}, expected one of {', '.join(FILE_TYPES)}")
+    return file_type
+
+def watched_files(source, directory, rollup_path):
+    if source == 'store':
+        paths = [os.path.join(directory, SUMMARY_FILE)]
+    else:
+        paths = sorted(glob.glob(os.path.join(directory, '*_sentiment_*.json'))
+                       + glob.glob(os.path.join(directory, '*_rolling_*.json')))
+    return paths + [rollup_path, CHANNELS_PATH]
+
+def files_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            signature.append((path, os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            pass
+    return tuple(signature)
+
+def percentiles(durations):
+    values = np.fromiter(durations, dtype=float) * 1000
+    p50, p99 = np.percentile(values, [50, 99])
+    return {'requests': len(values), 'p50_ms': p50.item(), 'p99_ms': p99.item(), 'max_ms': values.max().item()}
+
+class SentimentService:
+    """Routes, the response cache, latency tracking and hot reload"""
+
+    def __init__(self, source='json', directory=DEFAULT_STORE_DIR, rollup_path=DEFAULT_ROLLUP_PATH,
+                 cache_size=CACHE_SIZE):
+        self.source = source
+        self.directory = directory
+        self.rollup_path = rollup_path
+        self.cache_size = cache_size
+        self.routes = {
+            '/health': self.health,
+            '/series': self.query_series,
+            '/totals': self.query_totals,
+            '/groups': self.query_groups,
+            '/rolling': self.query_rolling,
+            '/stats': self.query_stats
+        }
+        self.cache = collections.OrderedDict()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.reloads = 0
+        self.renderer = None  # Created by the first /chart request, matplotlib is only imported then
+        self.signature = files_signature(self.watched())
+        self.data = self.load()
+
+    def watched(self):
+        return watched_files(self.source, self.directory, self.rollup_path)
+
+    def load(self):
+        started = time.perf_counter()
+        data = SentimentData(self.source, self.directory, self.rollup_path)
+        print(f"Loaded {len(data.series)} series"
+              + (f" and {len(data.rollup.keys):,} rollup buckets" if data.rollup is not None else '')
+              + f" in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return data
+
+    async def watch(self, interval):
+        """Reload once the output files change and then stay unchanged for one interval,
+        analyze rewrites its JSON files one by one and a half written set is never served"""
+        pending = None
+        while True:
+            await asyncio.sleep(interval)
+            signature = files_signature(self.watched())
+            if signature == self.signature:
+                pending = None
+            elif signature != pending:
+                pending = signature
+            else:
+                try:
+                    # Loaded off the event loop, queries keep using the old data meanwhile
+                    data = await asyncio.to_thread(self.load)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Reload failed, still serving the previous data: {e}")
+                    continue
+                self.data, self.signature, pending = data, signature, None
+                self.cache.clear()
+                self.reloads += 1
+
+    def respond(self, target):
+        """(status, body, route) for a GET target, answered from the cache when it was seen before"""
+        url = urlsplit(target)
+        route = url.path.rstrip('/') or '/health'
+        handler = self.routes.get(route)
+        if handler is None:
+            return 404, json.dumps({'error': f"Unknown route {url.path}", 'routes': list(self.routes)}).encode(), None
+
+        params = dict(parse_qsl(url.query))
+        key = (route, tuple(sorted(params.items())))
+        cacheable = route != '/stats'
+        if cacheable and key in self.cache:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return 200, self.cache[key], route
+
+        try:
+            body = json.dumps(handler(self.data, params), ensure_ascii=False).encode('utf-8')
+        except QueryError as e:
+            return e.status, json.dumps({'error': str(e)}).encode(), route
+        except ValueError as e:
+            return 400, json.dumps({'error': str(e)}).encode(), route
+
+        if cacheable:
+            self.cache_misses += 1
+            self.cache[key] = body
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return 200, body, route
+
+    async def respond_chart(self, query):
+        """/chart?chart=timeline&variant=percentage&file_type=all_messages&period=day&dpi=150&format=svg"""
+        params = dict(parse_qsl(query))
+        if self.renderer is None:
+            # The first chart imports matplotlib and the visualizer, a broken setup is a server error
+            try:
+                from chart_renderer import ChartRenderer
+                self.renderer = ChartRenderer(self.source, self.directory)
+            except Exception as e:
+                error = f"Charts are unavailable, {type(e).__name__}: {e}"
+                return 500, json.dumps({'error': error}).encode(), JSON_TYPE
+        try:
+            # Drawing takes up to seconds, the event loop keeps answering other queries meanwhile
+            image, content_type = await asyncio.to_thread(
+                self.renderer.render, params.get('chart', 'timeline'), params.get('file_type', 'all_messages'),
+                params.get('period', 'day'), params.get('variant'), params.get('dpi', 100), params.get('format', 'png'))
+        except ValueError as e:
+            return 400, json.dumps({'error': str(e)}).encode(), JSON_TYPE
+        except FileNotFoundError as e:
+            return 404, json.dumps({'error': str(e)}).encode(), JSON_TYPE
+        except Exception as e:
+            return 500, json.dumps({'error': f"{type(e).__name__}: {e}"}).encode(), JSON_TYPE
+        return 200, image, content_type
+
+    def health(self, data, params):
+        return {'status': 'ok', 'series': len(data.series), 'rollup': data.rollup is not None}
+
+    def query_series(self, data, params):
+        """/series?file_type=all_messages&period=day&start=2020-01-01&end=2020-02-01"""
+        file_type = file_type_param(params)
+        period = params.get('period', 'day')
+        columns = data.entry(file_type, period)
+        lo, hi = data.row_range(columns, period, params.get('start'), params.get('end'))
+        names = list(columns)
+        values = [columns[name][lo:hi] for name in names]
+        values = [column.tolist() if isinstance(column, np.ndarray) else column for column in values]
+        return {
+            'file_type': file_type,
+            'period': period,
+            'overall_stats': data.overall[file_type, period],
+            'time_series': [dict(zip(names, row)) for row in zip(*values)]
+        }
+
+    def query_rolling(self, data, params):
+        """/rolling?file_type=all_messages&period=day&column=average_polarity&start=2020-01-01, the rolling
+        mean, std, rate of change and EWMA analyze_sentiment stored, null where a window is not full"""
+        file_type = file_type_param(params)
+        period = params.get('period', 'day')
+        columns = data.entry(file_type, period)
+        if (file_type, period) not in data.rolling:
+            raise QueryError(404, f"No rolling stats for {file_type}/{period}")
+        rolling = data.rolling[file_type, period]
+        if 'column' in params:
+            if params['column'] not in rolling:
+                raise QueryError(400, f"No rolling stats of {params['column']}, expected one of {', '.join(rolling)}")
+            rolling = {params['column']: rolling[params['column']]}
+
+        lo, hi = data.row_range(columns, period, params.get('start'), params.get('end'))
+        return {
+            'file_type': file_type,
+            'period': period,
+            'dates': columns['date'][lo:hi],
+            'columns': {
+                column: {name: [None if np.isnan(value) else value for value in values[lo:hi].tolist()]
+                         for name, values in stats.items()}
+                for column, stats in rolling.items()
+            }
+        }
+
+    def query_totals(self, data, params):
+        """/totals?file_type=guild_messages&start=2021-01-01 15:00:00&end=2021-06-01, hour exact from the
+        rollup when there is one, else whole days from the day series"""
+        file_type = file_type_param(params)
+        start, end = params.get('start'), params.get('end')
+        if start is None and end is None:
+            data.entry(file_type, 'day')
+            return data.overall[file_type, 'day']
+        if data.rollup is not None:
+            return data.rollup.totals(start, end, channel_type=FILE_TYPE_FILTERS[file_type])
+
+        columns = data.entry(file_type, 'day')
+        lo, hi = data.row_range(columns, 'day', start, end)
+        counts = np.array([columns[name][lo:hi].sum() for name in
+                           ['message_count', 'positive_count', 'negative_count', 'neutral_count']])
+        # The day rows count scored messages only, their averages are weighted back into sums
+        sums = np.array([(columns[name][lo:hi] * columns['message_count'][lo:hi]).sum() for name in
+                         ['average_polarity', 'average_subjectivity']])
+        return {name: value.item() for name, value in bucket_stats(counts, sums).items()}
+
+    def query_groups(self, data, params):
+        """/groups?by=guild&file_type=all_messages&sort=average_polarity&order=desc&top=10&min_messages=20"""
+        if data.rollup is None:
+            raise QueryError(404, 'Group queries need the rollup, run analyze_sentiment --rollup')
+        by = params.get('by', 'channel')
+        sort = params.get('sort', 'message_count')
+        file_type = file_type_param(params)
+        top = int(params.get('top', 10))
+        if top < 0:
+            raise QueryError(400, 'top must be 0 (all groups) or more')
+        min_messages = int(params.get('min_messages', 0))
+        descending = params.get('order', 'desc') == 'desc'
+
+        totals = data.rollup.group_totals(by, params.get('start'), params.get('end'),
+                                          channel_type=FILE_TYPE_FILTERS[file_type])
+        if totals and sort not in next(iter(totals.values())):
+            raise QueryError(400, f"Cannot sort by {sort}")
+        groups = [group for group, stats in totals.items() if stats['scored_count'] >= min_messages]
+        groups.sort(key=lambda group: (-totals[group][sort] if descending else totals[group][sort], group))
+        if top:
+            groups = groups[:top]
+
+        rows = []
+        for group in groups:
+            info = group_info(by, group, data.channel_table) if by != 'channel_type' else {'id': group}
+            rows.append({**info, **totals[group]})
+        return {'group_by': by, 'sort': sort, 'groups': rows}
+
+    def query_stats(self, data, params):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'latency': {route: percentiles(durations) for route, durations in self.latencies.items() if durations},
+            'cache': {
+                'entries': len(self.cache),
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0
+            },
+            'reloads': self.reloads,
+            'charts': self.renderer.stats() if self.renderer is not None else None
+        }
+
+    async def handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1: GET only, keep-alive unless the client asks to close
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                started = time.perf_counter()
+                parts = request_line.decode('latin-1').split()
+                route = None
+                content_type = JSON_TYPE
+                if len(parts) != 3:
+                    status, body, keep_alive = 400, b'{"error": "Malformed request line"}', False
+                else:
+                    method, target, version = parts
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                    url = urlsplit(target)
+                    if method != 'GET':
+                        status, body = 405, b'{"error": "Only GET is supported"}'
+                    elif url.path.rstrip('/') == '/chart':
+                        status, body, content_type = await self.respond_chart(url.query)
+                        route = '/chart'
+                    else:
+                        status, body, route = self.respond(target)
+
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+                )
+                await writer.drain()
+                if route is not None:
+                    self.latencies[route].append(time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def print_latency(self):
+        stats = self.query_stats(self.data, {})
+        print(f"\n{'Route':<10} {'Requests':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for route, latency in sorted(stats['latency'].items()):
+            print(f"{route:<10} {latency['requests']:>9,} {latency['p50_ms']:>8.3f} {latency['p99_ms']:>8.3f}")
+        cache = stats['cache']
+        print(f"Response cache: {cache['hits']:,} hits, {cache['misses']:,} misses ({cache['hit_rate']:.1%} hit rate), "
+              f"{stats['reloads']} reloads")
+
+async def serve(service, host, port, reload_interval):
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Serving sentiment queries on http://{host}:{port} "
+          f"({', '.join(service.routes)}, /chart)")
+    watcher = asyncio.create_task(service.watch(reload_interval)) if reload_interval > 0 else None
+
+    # Ctrl+C or a kill stops the server cleanly so the latency report still prints
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopped.set)
+        except (NotImplementedError, RuntimeError):  # Windows, Ctrl+C raises KeyboardInterrupt instead
+            pass
+    async with server:
+        await stopped.wait()
+    if watcher is not None:
+        watcher.cancel()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local HTTP service answering queries over the sentiment results')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--input', choices=['json', 'store'], default='json',
+                        help='Serve the per-period JSON files or the columnar sentiment store')
+    parser.add_argument('--directory', default=DEFAULT_STORE_DIR, help='Where analyze_sentiment wrote its output')
+    parser.add_argument('--rollup', default=DEFAULT_ROLLUP_PATH,
+                        help='Rollup for group-by and hour exact range queries, used when it exists')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='Responses kept in memory')
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help='Seconds between checks for new analysis output, 0 disables hot reload')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        service = SentimentService(args.input, args.directory, args.rollup, args.cache_size)
+    except FileNotFoundError as e:
+        print(f"Nothing to serve, {e.filename or e} not found. Run analyze_sentiment.py first")
+        return
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.print_latency()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import errno
+import json
+import os
+import numpy as np
+
+# Every file type and period in one columnar .npz, with the overall stats in a small JSON summary
+DEFAULT_STORE_DIR = 'data/sentiment'
+STORE_FILE = 'sentiment_store.npz'
+SUMMARY_FILE = 'sentiment_summary.json'
+FORMAT_VERSION = 1
+
+# Time series column -> dtype, in the order the JSON rows list them
+LABEL_COLUMNS = {
+    'day_hour': {'weekday': '<U9', 'hour': '<U2'},
+    None: {'date': '<U10'}
+}
+VALUE_COLUMNS = {
+    'message_count': '<i8',
+    'positive_count': '<i8',
+    'negative_count': '<i8',
+    'neutral_count': '<i8',
+    'total_sentiment_count': '<i8',
+    'average_polarity': '<f8',
+    'average_subjectivity': '<f8'
+}
+
+def series_columns(period):
+    return {**LABEL_COLUMNS.get(period, LABEL_COLUMNS[None]), **VALUE_COLUMNS}
+
+def save_sentiment_store(results, directory=DEFAULT_STORE_DIR):
+    """Write {file_type: {period: results}} as one .npz of columns and a JSON summary"""
+    os.makedirs(directory, exist_ok=True)
+
+    arrays = {}
+    summary = {
+        'format_version': FORMAT_VERSION,
+        'store': STORE_FILE,
+        'series': {}
+    }
+    for file_type, periods in results.items():
+        summary['series'][file_type] = {}
+        for period, period_results in periods.items():
+            rows = period_results['time_series']
+            columns = series_columns(period)
+            for name, dtype in columns.items():
+                arrays[f'{file_type}/{period}/{name}'] = np.array([row[name] for row in rows], dtype=dtype)
+            summary['series'][file_type][period] = {
+                'rows': len(rows),
+                'columns': list(columns),
+                'overall_stats': period_results['overall_stats']
+            }
+            
+            # Rolling stats of the time ordered periods, null (window not full) is stored as NaN
+            rolling = period_results.get('rolling')
+            if rolling is not None:
+                for column, stats in rolling['columns'].items():
+                    for name, values in stats.items():
+                        arrays[f'{file_type}/{period}/rolling/{column}/{name}'] = np.array(
+                            [np.nan if value is None else value for value in values], dtype='<f8')
+                summary['series'][file_type][period]['rolling'] = {
+                    'windows': rolling['windows'],
+                    'roc_windows': rolling['roc_windows'],
+                    'spans': rolling['spans'],
+                    'columns': {column: list(stats) for column, stats in rolling['columns'].items()}
+                }
+
+    # Write both files next to their final names and swap them in, readers never see half a store
+    store_path = os.path.join(directory, STORE_FILE)
+    with open(store_path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    with open(os.path.join(directory, SUMMARY_FILE + '.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    os.replace(store_path + '.tmp', store_path)
+    os.replace(os.path.join(directory, SUMMARY_FILE + '.tmp'), os.path.join(directory, SUMMARY_FILE))
+
+class SentimentStore:
+    """Read access to a store written by save_sentiment_store"""
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        with open(os.path.join(directory, SUMMARY_FILE), 'r', encoding='utf-8') as f:
+            self.summary = json.load(f)
+        self.directory = directory
+        # Read every column up front, an open zip handle would be shared by forked worker processes
+        with np.load(os.path.join(directory, self.summary['store']), allow_pickle=False) as arrays:
+            self.arrays = {name: arrays[name] for name in arrays.files}
+
+    def entry(self, file_type, period):
+        try:
+            return self.summary['series'][file_type][period]
+        except KeyError:
+            path = os.path.join(self.directory, self.summary['store'])
+            raise FileNotFoundError(errno.ENOENT, f"No {file_type}/{period} series in the sentiment store",
+                                    f"{path}:{file_type}/{period}") from None
+
+    def columns(self, file_type, period):
+        """Time series as {column: values}, pandas builds the same DataFrame as from the JSON rows.
+        Numbers stay numpy arrays, labels become lists of str like the JSON strings."""
+        entry = self.entry(file_type, period)
+        columns = {}
+        for name in entry['columns']:
+            values = self.arrays[f'{file_type}/{period}/{name}']
+            columns[name] = values.tolist() if values.dtype.kind == 'U' else values
+        return columns
+
+    def rolling(self, file_type, period):
+        """Rolling stats like the JSON rolling files, values as arrays with NaN for null, None if not stored"""
+        entry = self.entry(file_type, period).get('rolling')
+        if entry is None:
+            return None
+        return {
+            'windows': entry['windows'],
+            'roc_windows': entry['roc_windows'],
+            'spans': entry['spans'],
+            'dates': self.arrays[f'{file_type}/{period}/date'].tolist(),
+            'columns': {
+                column: {name: self.arrays[f'{file_type}/{period}/rolling/{column}/{name}'] for name in names}
+                for column, names in entry['columns'].items()
+            }
+        }
+    
+    def results(self, file_type, period):
+        # Same shape as the JSON files, with the time series as columns instead of rows
+        results = {
+            'overall_stats': self.entry(file_type, period)['overall_stats'],
+            'time_series': self.columns(file_type, period)
+        }
+        rolling = self.rolling(file_type, period)
+        if rolling is not None:
+            results['rolling'] = rolling
+        return results
+
+_stores = {}
+
+def load_sentiment_results(file_type, period, directory=DEFAULT_STORE_DIR):
+    """Results of one file type and period from the store, reopened only when it changes"""
+    path = os.path.join(directory, SUMMARY_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(errno.ENOENT, 'Sentiment store not found', path) from None
+
+    cached = _stores.get(directory)
+    if cached is None or cached[0] != mtime:
+        cached = _stores[directory] = (mtime, SentimentStore(directory))
+    return cached[1].results(file_type, period)
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import numpy as np
+from timestamps import SECONDS_PER_DAY, period_codes, period_labels
+
+# Constant size sketches per time bucket, merging them is exact: histograms add and HyperLogLog
+# registers take the maximum. Day buckets roll up into weeks, months, years and weekdays, weekday/hour
+# buckets into hours, and the DM plus guild sketches into all messages, all without a rescan.
+RESOLUTION = 0.01  # Score histogram bin width, quantiles are within half of it
+POLARITY_LOW, POLARITY_BINS = -1.0, 201  # -1.00 .. 1.00
+SUBJECTIVITY_LOW, SUBJECTIVITY_BINS = 0.0, 101  # 0.00 .. 1.00
+QUANTILES = {'p10': 0.1, 'p25': 0.25, 'median': 0.5, 'p75': 0.75, 'p90': 0.9}
+HLL_PRECISION = 10  # 1024 registers per bucket, about 3% standard error on distinct counts
+BASE_PERIODS = {
+    'day': 'day',
+    'week': 'day',
+    'month': 'day',
+    'year': 'day',
+    'weekday': 'day',
+    'hour': 'day_hour',
+    'day_hour': 'day_hour'
+}
+
+def sketch_path(file_type):
+    return f'data/sentiment/sketches/{file_type}_sketches.npz'
+
+def quantiles_path(file_type, period):
+    return f'data/sentiment/{file_type}_quantiles_{period}.json'
+
+def histogram_bins(values, low, bins):
+    return np.clip(np.rint((values - low) / RESOLUTION), 0, bins - 1).astype(np.int64)
+
+def mix64(keys):
+    # splitmix64 finalizer, spreads snowflake IDs over all 64 bits
+    with np.errstate(over='ignore'):
+        z = keys.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def channel_hashes(messages):
+    """64-bit hash of every message's channel ID, and which messages have one at all"""
+    keys = {}
+    values = np.empty(len(messages), dtype=np.uint64)
+    known = np.ones(len(messages), dtype=bool)
+    for index, message in enumerate(messages):
+        channel_id = message.get('ChannelID') or ''
+        if not channel_id:
+            # Combined before channel IDs were kept, they cannot be told apart and are not counted
+            known[index] = False
+            values[index] = 0
+            continue
+        key = keys.get(channel_id)
+        if key is None:
+            if channel_id.isdigit():
+                key = int(channel_id) & 0xFFFFFFFFFFFFFFFF
+            else:
+                key = int.from_bytes(hashlib.blake2b(channel_id.encode('utf-8'), digest_size=8).digest(), 'little')
+            keys[channel_id] = key
+        values[index] = key
+    return mix64(values), known
+
+def leading_zeros(values):
+    # Exact count of leading zero bits of uint64 values, 64 for zero
+    values = values.copy()
+    zeros = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = values < np.uint64(1 << (64 - shift))
+        zeros += empty * shift
+        values = np.where(empty, values << np.uint64(shift), values)
+    return zeros + (values == 0)
+
+def hll_estimate(registers):
+    """Distinct count estimate of every row of registers, linear counting while registers are empty"""
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(float)), axis=-1)
+    empty = (registers == 0).sum(axis=-1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(empty, 1))
+    return np.rint(np.where((raw <= 2.5 * m) & (empty > 0), linear, raw)).astype(np.int64)
+
+def histogram_quantiles(histograms, low):
+    """{name: value} of every row's quantiles, NaN for empty rows"""
+    cumulative = np.cumsum(histograms, axis=-1)
+    totals = cumulative[..., -1:]
+    quantiles = {}
+    for name, q in QUANTILES.items():
+        # First bin holding the ceil(q * n)-th smallest score
+        target = np.maximum(np.ceil(q * totals), 1)
+        bins = (cumulative < target).sum(axis=-1)
+        quantiles[name] = np.where(totals[..., 0] > 0, np.round(low + bins * RESOLUTION, 2), np.nan)
+    return quantiles
+
+def derive_codes(codes, base, period):
+    # Bucket codes of a coarser period from the codes of its base period
+    if base == 'day':
+        return period_codes(codes * SECONDS_PER_DAY, period)
+    if period == 'hour':
+        return codes % 24
+    if period == 'weekday':
+        return codes // 24
+    return codes
+
+class PeriodSketches:
+    """Score histograms and channel HyperLogLog registers per bucket, buckets sorted by code"""
+
+    def __init__(self, period, codes=None):
+        # Empty sketches for the given bucket codes
+        self.period = period
+        self.codes = np.zeros(0, dtype=np.int64) if codes is None else np.asarray(codes, dtype=np.int64)
+        self.polarity = np.zeros((len(self.codes), POLARITY_BINS), dtype=np.int64)
+        self.subjectivity = np.zeros((len(self.codes), SUBJECTIVITY_BINS), dtype=np.int64)
+        self.registers = np.zeros((len(self.codes), 1 << HLL_PRECISION), dtype=np.uint8)
+
+    def slots(self, codes):
+        missing = np.setdiff1d(codes, self.codes)
+        if len(missing):
+            merged = self.merge(PeriodSketches(self.period, missing))
+            self.codes, self.polarity = merged.codes, merged.polarity
+            self.subjectivity, self.registers = merged.subjectivity, merged.registers
+        return np.searchsorted(self.codes, codes)
+
+    def add(self, codes, hashes, polarity, subjectivity, known=None):
+        """Add one batch, NaN scores (empty messages) only count towards the distinct channels,
+        messages that are not known (no channel ID) only towards the scores"""
+        slots = self.slots(codes)
+        scored = ~np.isnan(polarity)
+        np.add.at(self.polarity, (slots[scored], histogram_bins(polarity[scored], POLARITY_LOW, POLARITY_BINS)), 1)
+        np.add.at(self.subjectivity,
+                  (slots[scored], histogram_bins(subjectivity[scored], SUBJECTIVITY_LOW, SUBJECTIVITY_BINS)), 1)
+
+        index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+        rank = np.minimum(leading_zeros(hashes << np.uint64(HLL_PRECISION)), 64 - HLL_PRECISION) + 1
+        if known is not None:
+            slots, index, rank = slots[known], index[known], rank[known]
+        np.maximum.at(self.registers, (slots, index), rank.astype(np.uint8))
+
+    def merge(self, other):
+        """Sketches of both inputs together, exactly as if their messages had been added to one"""
+        codes = np.union1d(self.codes, other.codes)
+        merged = PeriodSketches(self.period, codes)
+        for part in (self, other):
+            slots = np.searchsorted(codes, part.codes)
+            merged.polarity[slots] += part.polarity
+            merged.subjectivity[slots] += part.subjectivity
+            merged.registers[slots] = np.maximum(merged.registers[slots], part.registers)
+        return merged
+
+    def rollup(self, period, codes=None):
+        """Merge buckets into a coarser period, or into the given codes (one per bucket)"""
+        if codes is None:
+            codes = derive_codes(self.codes, self.period, period)
+        unique, inverse = np.unique(codes, return_inverse=True)
+        inverse = inverse.ravel()
+        rolled = PeriodSketches(period, unique)
+        np.add.at(rolled.polarity, inverse, self.polarity)
+        np.add.at(rolled.subjectivity, inverse, self.subjectivity)
+        np.maximum.at(rolled.registers, inverse, self.registers)
+        return rolled
+
+    def stats(self):
+        # Column per stat, one value per bucket
+        stats = {'scored_count': self.polarity.sum(axis=1)}
+        for name, values in histogram_quantiles(self.polarity, POLARITY_LOW).items():
+            stats[f'polarity_{name}'] = values
+        for name, values in histogram_quantiles(self.subjectivity, SUBJECTIVITY_LOW).items():
+            stats[f'subjectivity_{name}'] = values
+        stats['distinct_channels'] = hll_estimate(self.registers)
+        return stats
+
+def json_stats(sketches):
+    # Stats as lists of plain numbers, NaN (no scored messages) becomes null
+    return {name: [None if value != value else value for value in values.tolist()]
+            for name, values in sketches.stats().items()}
+
+class SentimentSketches:
+    """Sketches of one file type, kept for the base periods and derived for the others"""
+
+    def __init__(self, base=None):
+        self.base = base or {period: PeriodSketches(period) for period in set(BASE_PERIODS.values())}
+
+    def add_batch(self, messages, epochs, polarity, subjectivity):
+        if len(messages) == 0:
+            return
+        hashes, known = channel_hashes(messages)
+        epochs = np.asarray(epochs, dtype=np.int64)
+        for period, sketches in self.base.items():
+            sketches.add(period_codes(epochs, period), hashes, polarity, subjectivity, known)
+
+    def merge(self, other):
+        return SentimentSketches({period: sketches.merge(other.base[period])
+                                  for period, sketches in self.base.items()})
+
+    def period(self, period):
+        if period not in BASE_PERIODS:
+            raise ValueError(f"Unknown period: {period}")
+        base = self.base[BASE_PERIODS[period]]
+        return base if base.period == period else base.rollup(period)
+
+    def results(self, period):
+        """Quantiles and distinct channels overall and per bucket, rows labelled like the analysis results"""
+        sketches = self.period(period)
+        overall = sketches.rollup('overall', np.zeros(len(sketches.codes), dtype=np.int64))
+        overall_stats = {name: values[0] if values else None for name, values in json_stats(overall).items()}
+
+        columns = json_stats(sketches)
+        time_series = []
+        for index, label in enumerate(period_labels(sketches.codes, period)):
+            row = label if isinstance(label, dict) else {'date': label}
+            time_series.append({**row, **{name: values[index] for name, values in columns.items()}})
+        return {
+            'overall_stats': overall_stats,
+            'resolution': RESOLUTION,
+            'hll_precision': HLL_PRECISION,
+            'time_series': time_series
+        }
+
+    def save(self, path, scorer_version=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = {'meta': np.array(json.dumps({'scorer_version': scorer_version, 'resolution': RESOLUTION,
+                                               'hll_precision': HLL_PRECISION}))}
+        for period, sketches in self.base.items():
+            arrays[f'{period}/codes'] = sketches.codes
+            arrays[f'{period}/polarity'] = sketches.polarity
+            arrays[f'{period}/subjectivity'] = sketches.subjectivity
+            arrays[f'{period}/registers'] = sketches.registers
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, scorer_version=None):
+        """Saved sketches to continue, None when missing or built by another scorer or layout"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(data['meta'].item())
+                if meta != {'scorer_version': scorer_version, 'resolution': RESOLUTION,
+                            'hll_precision': HLL_PRECISION}:
+                    return None
+                base = {}
+                for period in set(BASE_PERIODS.values()):
+                    sketches = base[period] = PeriodSketches(period)
+                    sketches.codes = data[f'{period}/codes']
+                    sketches.polarity = data[f'{period}/polarity']
+                    sketches.subjectivity = data[f'{period}/subjectivity']
+                    sketches.registers = data[f'{period}/registers']
+                return cls(base)
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,99 @@
+import json
+import os
+import numpy as np
+import analyze_sentiment
+from json_stream import JsonArrayWriter
+from message_store import FILE_TYPE_FILTERS
+from timestamps import format_timestamps, parse_timestamp
+
+WORDS = ['good', 'bad', 'happy', 'sad', 'lol', 'the', 'great', 'terrible', 'love', 'ok']
+CHANNELS = [{'id': str(1000 + index), 'type': 'DM' if index < 4 else 'Guild',
+             'name': None if index < 4 else f'ch{index}', 'guild_id': None if index < 4 else str(50 + index % 2),
+             'guild_name': None if index < 4 else f'g{index % 2}'} for index in range(10)]
+ARGS = ['--no-cache', '--scorer', 'lexicon', '--breakdown', '--sketches']
+
+def make_messages(count=1500, seed=1):
+    rng = np.random.default_rng(seed)
+    start = parse_timestamp('2020-01-01')
+    epochs = np.sort(rng.integers(start, start + 90 * 86400, count))
+    timestamps = format_timestamps(epochs)
+    messages = []
+    for index, timestamp in enumerate(timestamps):
+        # Some messages are empty, some repeat a text
+        words = rng.choice(WORDS, rng.integers(0, 6)).tolist()
+        messages.append({'ID': 100000 + index, 'Timestamp': timestamp, 'Contents': ' '.join(words),
+                         'Attachments': '', 'ChannelID': CHANNELS[rng.integers(0, len(CHANNELS))]['id']})
+    return messages
+
+def write_raw(directory, messages):
+    raw = os.path.join(directory, 'data', 'raw')
+    os.makedirs(raw, exist_ok=True)
+    with open(os.path.join(raw, 'channels.json'), 'w', encoding='utf-8') as f:
+        json.dump(CHANNELS, f)
+    types = {channel['id']: channel['type'] for channel in CHANNELS}
+    for file_type, channel_type in FILE_TYPE_FILTERS.items():
+        with JsonArrayWriter(os.path.join(raw, f'{file_type}.json')) as writer:
+            writer.write_all(message for message in messages
+                             if channel_type is None or types[message['ChannelID']] == channel_type)
+
+def run_analyze(monkeypatch, directory, *args):
+    monkeypatch.chdir(directory)
+    analyze_sentiment.main(ARGS + list(args))
+
+def load_outputs(directory):
+    # Every results file by its path under data/sentiment, the incremental state aside
+    root = os.path.join(directory, 'data', 'sentiment')
+    outputs = {}
+    for folder, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            key = os.path.relpath(path, root)
+            if key.startswith('state'):
+                continue
+            if name.endswith('.npz'):
+                with np.load(path, allow_pickle=False) as arrays:
+                    outputs[key] = {array: arrays[array].tolist() for array in arrays.files}
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    outputs[key] = json.load(f)
+    return outputs
+
+def test_incremental_runs_equal_a_full_run(tmp_path, monkeypatch):
+    messages = make_messages()
+    # The split falls between two messages of the same second, the high-water IDs tell them apart
+    split = 900
+    messages[split]['Timestamp'] = messages[split - 1]['Timestamp']
+
+    full = tmp_path / 'full'
+    write_raw(full, messages)
+    run_analyze(monkeypatch, full)
+
+    incremental = tmp_path / 'incremental'
+    write_raw(incremental, messages[:split])
+    run_analyze(monkeypatch, incremental)
+    write_raw(incremental, messages)
+    run_analyze(monkeypatch, incremental, '--incremental')
+
+    expected = load_outputs(full)
+    assert 'rollup.npz' in expected and 'sketches/all_messages_sketches.npz' in expected
+    assert expected['all_messages_sentiment_day.json']['overall_stats']['message_count'] == len(messages)
+    assert load_outputs(incremental) == expected
+
+    # Nothing new, nothing changes
+    run_analyze(monkeypatch, incremental, '--incremental')
+    assert load_outputs(incremental) == expected
+
+def test_state_round_trips_through_json():
+    aggregator = analyze_sentiment.SentimentAggregator(['day', 'month', 'hour'])
+    messages = make_messages(200, seed=2)
+    epochs = np.array([parse_timestamp(message['Timestamp']) for message in messages])
+    polarity = np.random.default_rng(3).uniform(-1, 1, len(messages))
+    polarity[::7] = np.nan
+    aggregator.add_batch(epochs, polarity, np.abs(polarity))
+    aggregator.track_high_water(messages, epochs)
+
+    state = json.loads(json.dumps(aggregator.to_state('scorer-1')))
+    restored = analyze_sentiment.SentimentAggregator.from_state(state)
+    for period in ['day', 'month', 'hour']:
+        assert restored.results(period) == aggregator.results(period)
+    assert list(restored.iter_new_messages(messages)) == []
@@ -0,0 +1,64 @@
+import json
+import os
+import pytest
+from json_stream import IngestStats, JsonArrayWriter, iter_json_array, iter_json_batches
+
+# Escapes, multi-byte characters and numbers that a buffer boundary can cut in half
+ITEMS = [
+    {'ID': 100000000000645197, 'Timestamp': '2019-01-01 04:25:06', 'Contents': 'good', 'ChannelID': '1003'},
+    {'ID': 2, 'Contents': 'quote " backslash \\ tab \t newline \n', 'Attachments': ''},
+    {'ID': 3, 'Contents': 'çok güzel 😀 日本語', 'Score': -1.5e-07},
+    {'ID': 4, 'Contents': '', 'Nested': {'list': [1, 2.25, None, True, False], 'empty': {}}},
+    [],
+    'plain string',
+    12345678901234567890,
+    1.5e+300,
+    None
+]
+READ_SIZES = [1, 3, 7, 64, 1 << 20]
+
+def write_items(path, items, track_offsets=False):
+    with JsonArrayWriter(path, track_offsets) as writer:
+        writer.write_all(items)
+    return writer
+
+@pytest.mark.parametrize('items', [ITEMS, [], [{}], [ITEMS[2]]])
+def test_writer_matches_json_dumps(tmp_path, items):
+    path = tmp_path / 'items.json'
+    write_items(path, items)
+    expected = json.dumps(items, indent=2, ensure_ascii=False).replace('\n', os.linesep).encode('utf-8')
+    assert path.read_bytes() == expected
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+def test_reader_round_trips(tmp_path, read_size):
+    path = tmp_path / 'items.json'
+    write_items(path, ITEMS)
+    stats = IngestStats()
+    assert list(iter_json_array(path, stats, read_size=read_size)) == ITEMS
+    assert stats.items == len(ITEMS)
+    assert stats.bytes_read == path.stat().st_size
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+def test_reader_accepts_compact_json_and_byte_order_mark(tmp_path, read_size):
+    path = tmp_path / 'items.json'
+    path.write_bytes(b'\xef\xbb\xbf' + json.dumps(ITEMS, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    assert list(iter_json_array(path, read_size=read_size)) == ITEMS
+
+def test_reader_handles_empty_array(tmp_path):
+    path = tmp_path / 'empty.json'
+    write_items(path, [])
+    assert list(iter_json_array(path, read_size=1)) == []
+
+@pytest.mark.parametrize('text', ['{"ID": 1}', '[{"ID": 1}, {"ID": 2}', '[{"ID": 1} {"ID": 2}]'])
+def test_reader_rejects_malformed_input(tmp_path, text):
+    path = tmp_path / 'bad.json'
+    path.write_text(text, encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(iter_json_array(path, read_size=4))
+
+def test_batches_cover_every_item(tmp_path):
+    path = tmp_path / 'items.json'
+    write_items(path, ITEMS)
+    batches = list(iter_json_batches(path, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 1]
+    assert [item for batch in batches for item in batch] == ITEMS
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rolling import ROLLING_COLUMNS, ewma, rate_of_change, rolling_mean_std, rolling_results
+
+SERIES = {
+    'random': np.random.default_rng(1).normal(0.1, 0.3, 200),
+    'counts': np.random.default_rng(2).integers(0, 5000, 200).astype(float),
+    'short': np.array([0.5, -0.25, 1.0]),
+    'empty': np.zeros(0)
+}
+
+@pytest.mark.parametrize('name', list(SERIES))
+def test_matches_pandas(name):
+    values = SERIES[name]
+    series = pd.Series(values, dtype=float)
+    windows, roc_windows, spans = [1, 7, 30], [1, 7], [7, 30]
+
+    mean, std = rolling_mean_std(values, windows)
+    for index, window in enumerate(windows):
+        np.testing.assert_allclose(mean[index], series.rolling(window).mean(), rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(std[index], series.rolling(window).std(), rtol=1e-9, atol=1e-12)
+    for index, window in enumerate(roc_windows):
+        np.testing.assert_allclose(rate_of_change(values, roc_windows)[index], series.diff(window))
+    for index, span in enumerate(spans):
+        np.testing.assert_allclose(ewma(values, spans)[index], series.ewm(span=span, adjust=False).mean())
+
+def test_std_does_not_cancel_next_to_large_values():
+    # Sums of squares over the whole series would lose the small window entirely
+    values = np.array([1e6] * 50 + [1.0] * 7 + [2.0])
+    mean, std = rolling_mean_std(values, [7])
+    assert std[0, 56] == 0.0
+    assert std[0, -1] == pytest.approx(0.3779644730092272, rel=1e-12)
+    assert mean[0, -1] == pytest.approx(8 / 7, rel=1e-12)
+
+def test_results_are_json_ready():
+    rows = [{'date': f'2020-01-{day:02d}', **{column: float(day % 3) for column in ROLLING_COLUMNS}}
+            for day in range(1, 11)]
+    results = rolling_results(rows, windows=[7], roc_windows=[1], spans=[7])
+    assert results['dates'] == [row['date'] for row in rows]
+    stats = results['columns']['average_polarity']
+    assert stats['mean_7'][:6] == [None] * 6 and stats['mean_7'][6] == pytest.approx(1.0)
+    assert stats['std_7'][5] is None and stats['roc_1'][0] is None
+    assert all(len(values) == len(rows) for values in stats.values())
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from sketches import BASE_PERIODS, RESOLUTION, SentimentSketches, hll_estimate, leading_zeros
+from timestamps import parse_timestamp
+
+def make_batch(count, channels, seed):
+    rng = np.random.default_rng(seed)
+    start = parse_timestamp('2020-01-01')
+    epochs = np.sort(rng.integers(start, start + 400 * 86400, count))
+    messages = [{'ID': index, 'ChannelID': str(1000 + channel)}
+                for index, channel in enumerate(rng.integers(0, channels, count).tolist())]
+    polarity = np.round(rng.uniform(-1, 1, count), 3)
+    subjectivity = np.round(rng.uniform(0, 1, count), 3)
+    polarity[rng.random(count) < 0.1] = np.nan  # Empty messages
+    subjectivity[np.isnan(polarity)] = np.nan
+    return messages, epochs, polarity, subjectivity
+
+def sketches_of(*batches):
+    sketches = SentimentSketches()
+    for batch in batches:
+        sketches.add_batch(*batch)
+    return sketches
+
+def assert_same(left, right):
+    for period in left.base:
+        for name in ('codes', 'polarity', 'subjectivity', 'registers'):
+            np.testing.assert_array_equal(getattr(left.base[period], name), getattr(right.base[period], name))
+
+def test_merge_equals_adding_everything_to_one():
+    first, second = make_batch(3000, 300, 1), make_batch(2000, 500, 2)
+    assert_same(sketches_of(first).merge(sketches_of(second)), sketches_of(first, second))
+
+def test_batches_add_up_like_one_batch():
+    messages, epochs, polarity, subjectivity = make_batch(3000, 300, 3)
+    halves = [(messages[part], epochs[part], polarity[part], subjectivity[part])
+              for part in (slice(0, 1234), slice(1234, None))]
+    assert_same(sketches_of(*halves), sketches_of((messages, epochs, polarity, subjectivity)))
+
+@pytest.mark.parametrize('period', list(BASE_PERIODS))
+def test_derived_periods_count_every_scored_message(period):
+    batch = make_batch(3000, 300, 4)
+    results = sketches_of(batch).results(period)
+    scored = int((~np.isnan(batch[2])).sum())
+    assert sum(row['scored_count'] for row in results['time_series']) == scored
+    assert results['overall_stats']['scored_count'] == scored
+
+def test_quantiles_are_within_half_a_bin():
+    messages, epochs, polarity, subjectivity = make_batch(5000, 50, 5)
+    overall = sketches_of((messages, epochs, polarity, subjectivity)).results('day')['overall_stats']
+    scored = polarity[~np.isnan(polarity)]
+    for name, q in [('p10', 0.1), ('median', 0.5), ('p90', 0.9)]:
+        exact = np.quantile(scored, q, method='inverted_cdf')
+        assert abs(overall[f'polarity_{name}'] - exact) <= RESOLUTION / 2 + 1e-9
+
+@pytest.mark.parametrize('channels', [1, 40, 800, 20000])
+def test_distinct_channels_are_close(channels):
+    messages, epochs, polarity, subjectivity = make_batch(50000, channels, 6)
+    actual = len({message['ChannelID'] for message in messages})
+    estimate = sketches_of((messages, epochs, polarity, subjectivity)).results('day')['overall_stats']
+    # About 3% standard error with 1024 registers, exact while few registers are taken
+    assert abs(estimate['distinct_channels'] - actual) <= max(1, 0.1 * actual)
+
+def test_messages_without_a_channel_are_scored_but_not_counted():
+    messages, epochs, polarity, subjectivity = make_batch(500, 5, 7)
+    unknown = [{'ID': message['ID']} for message in messages]
+    overall = sketches_of((unknown, epochs, polarity, subjectivity)).results('month')['overall_stats']
+    assert overall['distinct_channels'] == 0
+    assert overall['scored_count'] == int((~np.isnan(polarity)).sum())
+
+def test_leading_zeros_and_empty_registers():
+    values = np.array([0, 1, 1 << 63, (1 << 32) - 1, 1 << 40], dtype=np.uint64)
+    np.testing.assert_array_equal(leading_zeros(values), [64, 63, 0, 32, 23])
+    assert hll_estimate(np.zeros((1, 1024), dtype=np.uint8)).tolist() == [0]
+
+def test_save_and_load_round_trip(tmp_path):
+    sketches = sketches_of(make_batch(1000, 30, 8))
+    path = str(tmp_path / 'sketches' / 'all_messages_sketches.npz')
+    sketches.save(path, 'scorer-1')
+    assert_same(SentimentSketches.load(path, 'scorer-1'), sketches)
+    assert SentimentSketches.load(path, 'scorer-2') is None
+    assert SentimentSketches.load(str(tmp_path / 'missing.npz'), 'scorer-1') is None
@@ -0,0 +1,62 @@
+import os
+import pytest
+from json_stream import JsonArrayWriter, iter_json_array
+from time_index import TimeIndex, filter_messages, iter_messages_between, save_time_index
+from timestamps import parse_timestamp
+
+TIMESTAMPS = ['2020-01-01 00:00:00', '2020-01-01 00:00:00', '2020-01-01 12:30:00', '2020-01-02 00:00:00',
+              '2020-02-29 23:59:59', '2020-03-01 00:00:00', '2021-06-15 08:00:00']
+MESSAGES = [{'ID': index, 'Timestamp': timestamp, 'Contents': f'message {index} ü', 'ChannelID': '1'}
+            for index, timestamp in enumerate(TIMESTAMPS)]
+RANGES = [(None, None), ('2020-01-01', None), (None, '2020-01-01'), ('2020-01-01 00:00:01', '2020-03-01'),
+          ('2020-01-02', '2020-01-02 00:00:01'), ('2020-03-01', '2030-01-01'), ('2019-01-01', '2019-12-31'),
+          ('2021-01-01', '2020-01-01')]
+
+def write_indexed(path, messages):
+    # The way combine-messages.py writes a combined file and its index
+    with JsonArrayWriter(path, track_offsets=True) as writer:
+        writer.write_all(messages)
+    save_time_index(path, [parse_timestamp(message['Timestamp']) for message in messages], writer.offsets)
+
+@pytest.mark.parametrize('read_size', [1, 7, 64, 1 << 20])
+def test_offsets_resume_at_every_element(tmp_path, read_size):
+    path = tmp_path / 'all_messages.json'
+    with JsonArrayWriter(path, track_offsets=True) as writer:
+        writer.write_all(MESSAGES)
+    for index, offset in enumerate(writer.offsets):
+        assert list(iter_json_array(path, offset=offset, read_size=read_size)) == MESSAGES[index:]
+
+@pytest.mark.parametrize('start, end', RANGES)
+def test_index_matches_a_full_scan(tmp_path, start, end):
+    path = str(tmp_path / 'all_messages.json')
+    write_indexed(path, MESSAGES)
+    index = TimeIndex.open(path)
+    assert index is not None and index.rows == len(MESSAGES)
+    expected = list(filter_messages(MESSAGES, start, end))
+    assert list(index.iter_messages(path, start, end)) == expected
+    assert list(iter_messages_between(path, start, end)) == expected
+
+def test_empty_file_has_an_index(tmp_path):
+    path = str(tmp_path / 'dm_messages.json')
+    write_indexed(path, [])
+    assert list(TimeIndex.open(path).iter_messages(path, '2020-01-01')) == []
+
+def test_stale_or_unsorted_index_is_not_used(tmp_path):
+    path = str(tmp_path / 'all_messages.json')
+    assert TimeIndex.open(path) is None
+
+    write_indexed(path, MESSAGES)
+    with open(path, 'ab') as f:
+        f.write(b' ')
+    assert TimeIndex.open(path) is None
+
+    write_indexed(path, MESSAGES[::-1])
+    assert TimeIndex.open(path) is None
+    # Without a usable index the range still comes out right, from a scan
+    assert list(iter_messages_between(path, '2020-01-02', '2021-01-01')) == MESSAGES[3:6][::-1]
+
+def test_index_lives_next_to_the_file(tmp_path):
+    path = str(tmp_path / 'guild_messages.json')
+    write_indexed(path, MESSAGES)
+    directory = os.path.join(str(tmp_path), 'time_index', 'guild_messages')
+    assert sorted(os.listdir(directory)) == ['meta.json', 'offset.npy', 'timestamp.npy']
@@ -0,0 +1,100 @@
+import json
+import os
+import numpy as np
+from itertools import islice
+from json_stream import iter_json_array
+from timestamps import parse_timestamp, parse_timestamps
+
+# Sorted timestamps and byte offsets of the messages of a combined JSON file, written by combine-messages.py
+# next to the file. A time range is two binary searches, reading it starts at the first message's offset.
+INDEX_DIR = 'time_index'
+
+def index_dir(json_path):
+    # data/raw/all_messages.json -> data/raw/time_index/all_messages
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    return os.path.join(os.path.dirname(json_path), INDEX_DIR, name)
+
+def to_epoch(value):
+    # Range bounds as epoch seconds, 'YYYY-MM-DD[ HH:MM:SS]' strings or numbers
+    return parse_timestamp(value) if isinstance(value, str) else value
+
+def range_bounds(timestamps, start=None, end=None):
+    """(first, last) rows of sorted timestamps with start <= timestamp < end"""
+    first = int(np.searchsorted(timestamps, to_epoch(start), 'left')) if start is not None else 0
+    last = int(np.searchsorted(timestamps, to_epoch(end), 'left')) if end is not None else len(timestamps)
+    return first, max(first, last)
+
+def save_time_index(json_path, epochs, offsets):
+    """Write the index of a JSON file just written, epochs and offsets in the order of its elements"""
+    directory = index_dir(json_path)
+    os.makedirs(directory, exist_ok=True)
+    epochs = np.asarray(epochs, dtype=np.int64)
+    np.save(os.path.join(directory, 'timestamp.npy'), epochs)
+    np.save(os.path.join(directory, 'offset.npy'), np.asarray(offsets, dtype=np.int64))
+
+    # The file's size and mtime tell a stale index from a current one
+    stat = os.stat(json_path)
+    meta = {
+        'rows': len(epochs),
+        'sorted': bool(np.all(epochs[1:] >= epochs[:-1])),
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+class TimeIndex:
+    """Memory-mapped index of one combined JSON file"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.rows = self.meta['rows']
+        # Zero-length arrays cannot be memory-mapped
+        mmap_mode = 'r' if self.rows > 0 else None
+        self.timestamp = np.load(os.path.join(directory, 'timestamp.npy'), mmap_mode=mmap_mode)
+        self.offset = np.load(os.path.join(directory, 'offset.npy'), mmap_mode=mmap_mode)
+
+    @classmethod
+    def open(cls, json_path):
+        """Index of a JSON file, None when it is missing, unsorted or older than the file"""
+        try:
+            index = cls(index_dir(json_path))
+            stat = os.stat(json_path)
+        except FileNotFoundError:
+            return None
+        if not index.meta['sorted'] or index.meta['source_size'] != stat.st_size or \
+                index.meta['source_mtime_ns'] != stat.st_mtime_ns:
+            return None
+        return index
+
+    def bounds(self, start=None, end=None):
+        return range_bounds(self.timestamp, start, end)
+
+    def iter_messages(self, json_path, start=None, end=None, stats=None):
+        """Messages with start <= timestamp < end, parsing only their part of the file"""
+        first, last = self.bounds(start, end)
+        if first == last:
+            return iter(())
+        return islice(iter_json_array(json_path, stats, offset=int(self.offset[first])), last - first)
+
+def filter_messages(messages, start=None, end=None, batch_size=65536):
+    # Without an index every message is parsed and its timestamp checked
+    start, end = to_epoch(start), to_epoch(end)
+    messages = iter(messages)
+    while True:
+        batch = list(islice(messages, batch_size))
+        if not batch:
+            return
+        epochs = parse_timestamps(message['Timestamp'] for message in batch).tolist()
+        for message, epoch in zip(batch, epochs):
+            if (start is None or epoch >= start) and (end is None or epoch < end):
+                yield message
+
+def iter_messages_between(json_path, start=None, end=None, stats=None):
+    """Messages of a combined JSON file in a time range, through its index when it has a current one"""
+    index = TimeIndex.open(json_path)
+    if index is None:
+        print(f"No current time index for {json_path}, scanning the whole file")
+        return filter_messages(iter_json_array(json_path, stats), start, end)
+    return index.iter_messages(json_path, start, end, stats)
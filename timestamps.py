@@ -0,0 +1,55 @@
+import numpy as np
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SECONDS_PER_DAY = 86400
+
+def parse_timestamps(timestamps):
+    # 'YYYY-MM-DD HH:MM:SS' strings -> int64 epoch seconds in a single call
+    return np.array(list(timestamps), dtype='datetime64[s]').astype(np.int64)
+
+def parse_timestamp(timestamp):
+    return int(np.datetime64(timestamp, 's').astype(np.int64))
+
+def format_timestamps(epochs):
+    strings = np.datetime_as_string(np.asarray(epochs, dtype=np.int64).astype('datetime64[s]'))
+    return [s.replace('T', ' ') for s in strings.tolist()]
+
+def period_codes(epochs, period='day'):
+    """Integer bucket code of every timestamp for a period"""
+    epochs = np.asarray(epochs, dtype=np.int64)
+    days = epochs // SECONDS_PER_DAY
+    if period == 'day':
+        return days
+    elif period == 'month':
+        return epochs.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    elif period == 'year':
+        return epochs.astype('datetime64[s]').astype('datetime64[Y]').astype(np.int64)
+    elif period == 'week':
+        return (days + 3) // 7  # Weeks start on Monday, week 0 starts on 1969-12-29
+    elif period == 'weekday':
+        return (days + 3) % 7  # 1970-01-01 was a Thursday, Monday is 0
+    elif period == 'hour':
+        return (epochs // 3600) % 24
+    elif period == 'day_hour':
+        return ((days + 3) % 7) * 24 + (epochs // 3600) % 24
+    raise ValueError(f"Unknown period: {period}")
+
+def period_labels(codes, period='day'):
+    """Labels matching get_time_period for an array of period codes"""
+    codes = np.asarray(codes, dtype=np.int64)
+    if period == 'day':
+        return np.datetime_as_string(codes.astype('datetime64[D]')).tolist()
+    elif period == 'month':
+        return np.datetime_as_string(codes.astype('datetime64[M]')).tolist()
+    elif period == 'year':
+        return np.datetime_as_string(codes.astype('datetime64[Y]')).tolist()
+    elif period == 'week':
+        # The date of the week's Monday
+        return np.datetime_as_string((codes * 7 - 3).astype('datetime64[D]')).tolist()
+    elif period == 'weekday':
+        return [WEEKDAYS[code] for code in codes.tolist()]
+    elif period == 'hour':
+        return [f"{code:02d}" for code in codes.tolist()]
+    elif period == 'day_hour':
+        return [{'weekday': WEEKDAYS[code // 24], 'hour': f"{code % 24:02d}"} for code in codes.tolist()]
+    raise ValueError(f"Unknown period: {period}")
@@ -1,28 +1,81 @@
+import argparse
+import functools
+import hashlib
+import inspect
+import io
 import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Figures are only saved, never shown
 import matplotlib.pyplot as plt
 import seaborn as sns
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 from pandas._libs.tslibs.np_datetime import OutOfBoundsDatetime
 import numpy as np
 from matplotlib.colors import LinearSegmentedColormap
+from instrumentation import add_trace_arguments, finish_tracing, start_tracing, tracer
+from sentiment_store import DEFAULT_STORE_DIR, load_sentiment_results
 
 plt.style.use('seaborn')
 sns.set_palette("husl")
 
+MANIFEST_PATH = 'graphs/.build_manifest.json'
+
 def load_json_file(filepath):
     with open(filepath, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def load_results(file_type, period, source='json', directory=DEFAULT_STORE_DIR):
+    # The per-period JSON files, or the same results from the columnar sentiment store
+    if source == 'store':
+        return load_sentiment_results(file_type, period, directory)
+    data = load_json_file(os.path.join(directory, f'{file_type}_sentiment_{period}.json'))
+    rolling_file = os.path.join(directory, f'{file_type}_rolling_{period}.json')
+    if os.path.exists(rolling_file):
+        data['rolling'] = load_json_file(rolling_file)
+    return data
+
 def ensure_dir(directory):
     os.makedirs(directory, exist_ok=True)
 
+@contextmanager
+def render_options(dpi=None, format=None, capture=None):
+    """Override the dpi and format of every plt.savefig inside the block.
+    With a capture dict the images are kept in it by output path instead of written to disk."""
+    savefig = plt.savefig
+    
+    def patched(fname, *args, **kwargs):
+        if dpi is not None:
+            kwargs['dpi'] = dpi
+        if format is not None:
+            kwargs['format'] = format
+            fname = f'{os.path.splitext(fname)[0]}.{format}'
+        if capture is None:
+            return savefig(fname, *args, **kwargs)
+        buffer = io.BytesIO()
+        savefig(buffer, *args, **kwargs)
+        capture[fname] = buffer.getvalue()
+    
+    plt.savefig = patched
+    try:
+        yield capture
+    finally:
+        plt.savefig = savefig
+
 def create_time_series_df(data):
     df = pd.DataFrame(data['time_series'])
     
+    # Rolling stats precomputed by analyze_sentiment, as <column>_<stat> columns (average_polarity_std_7)
+    rolling = data.get('rolling')
+    if rolling is not None and len(rolling['dates']) == len(df):
+        for column, stats in rolling['columns'].items():
+            for name, values in stats.items():
+                df[f'{column}_{name}'] = np.asarray(values, dtype=float)
+    
     if all(str(x).isdigit() for x in df['date'].unique()):
         df['date'] = df['date'].astype(int)
         return df
@@ -122,7 +175,10 @@ def plot_sentiment_momentum(df, file_type, output_dir):
     if isinstance(df['date'].dtype, np.int64) or isinstance(df['date'].dtype, int):
         return
         
-    df['sentiment_momentum'] = df['total_sentiment_count'].diff()
+    if 'total_sentiment_count_roc_1' in df:
+        df['sentiment_momentum'] = df['total_sentiment_count_roc_1']
+    else:
+        df['sentiment_momentum'] = df['total_sentiment_count'].diff()
     
     plt.figure(figsize=(12, 6))
     plt.plot(df['date'], df['sentiment_momentum'], color='#3498db')
@@ -142,7 +198,10 @@ def plot_sentiment_volatility(df, file_type, output_dir):
         return
         
     window = 7  # 7-day window
-    df['sentiment_volatility'] = df['average_polarity'].rolling(window).std()
+    if f'average_polarity_std_{window}' in df:
+        df['sentiment_volatility'] = df[f'average_polarity_std_{window}']
+    else:
+        df['sentiment_volatility'] = df['average_polarity'].rolling(window).std()
     
     plt.figure(figsize=(12, 6))
     plt.plot(df['date'], df['sentiment_volatility'], color='#9b59b6', linewidth=2)
@@ -173,7 +232,8 @@ def plot_volume_sentiment_relationship(df, file_type, output_dir):
     plt.savefig(f'{output_dir}/relationship/volume_sentiment_{file_type}.png')
     plt.close()
 
-def plot_weekly_heatmap(file_types, output_dir):
+def plot_weekly_heatmap(file_types, output_dir, source='json', versions=('adjusted', 'fixed'),
+                        directory=DEFAULT_STORE_DIR):
     """Create heatmap showing sentiment patterns across days and hours"""
     try:
         weekday_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
@@ -182,7 +242,7 @@ def plot_weekly_heatmap(file_types, output_dir):
         for file_type in file_types:
             try:
                 # Load the day_hour data directly
-                data = load_json_file(f'data/sentiment/{file_type}_sentiment_day_hour.json')
+                data = load_results(file_type, 'day_hour', source, directory)
                 df = pd.DataFrame(data['time_series'])
                 
                 # Create pivot table for heatmap
@@ -194,8 +254,8 @@ def plot_weekly_heatmap(file_types, output_dir):
                     aggfunc='mean'
                 ).reindex(weekday_order)
                 
-                # Create both adjusted and fixed-range versions
-                for version in ['adjusted', 'fixed']:
+                # Create both adjusted and fixed-range versions, or only the one asked for
+                for version in versions:
                     # Set up color scheme and range based on version
                     if version == 'adjusted':
                         vmin = heatmap_data.min().min()
@@ -328,7 +388,237 @@ def plot_sentiment_over_time(df, file_type, period, output_dir, include_neutral=
                 dpi=300, bbox_inches='tight', facecolor='white')
     plt.close()
 
-def main():
+def plot_job(plot, file_type, period, inputs, args, outputs, kwargs=None, source='json', directory=DEFAULT_STORE_DIR):
+    """Description of one independent figure, picklable so a worker process can render it"""
+    return {
+        'name': f"{plot}[{file_type}/{period}]",
+        'plot': plot,
+        'file_type': file_type,
+        'period': period,
+        'format': source,  # 'json' or 'store', see load_results
+        'directory': directory,
+        'source': f'{source}:{file_type}/{period}',
+        'inputs': inputs,  # 'data' for the raw JSON, 'frame' for create_time_series_df, None if the plot loads it
+        'slice': 'overall_stats' if inputs == 'data' else 'time_series',  # Part of the source the figure uses
+        'args': args,
+        'kwargs': kwargs or {},
+        'outputs': outputs
+    }
+
+def build_plot_jobs(file_types, periods, base_dir, source='json', directory=DEFAULT_STORE_DIR):
+    """Every figure main() produces, in the order the serial loop used to draw them"""
+    jobs = []
+    make_job = functools.partial(plot_job, source=source, directory=directory)
+    for file_type in file_types:
+        # Generate distribution plot only once per file_type using day period
+        jobs.append(make_job('plot_sentiment_distribution', file_type, 'day', 'data',
+                             ("Overall", file_type, base_dir),
+                             [f'{base_dir}/distribution/sentiment_distribution_{file_type}_Overall.png']))
+        
+        # Continue with other visualizations for all periods
+        for period in periods:
+            frame_args = (file_type, base_dir)
+            jobs.append(make_job('plot_sentiment_correlation', file_type, period, 'frame', frame_args,
+                                 [f'{base_dir}/correlation/polarity_subjectivity_{file_type}.png']))
+            jobs.append(make_job('plot_sentiment_momentum', file_type, period, 'frame', frame_args,
+                                 [f'{base_dir}/momentum/sentiment_momentum_{file_type}.png']))
+            jobs.append(make_job('plot_sentiment_volatility', file_type, period, 'frame', frame_args,
+                                 [f'{base_dir}/volatility/sentiment_volatility_{file_type}.png']))
+            jobs.append(make_job('plot_volume_sentiment_relationship', file_type, period, 'frame', frame_args,
+                                 [f'{base_dir}/relationship/volume_sentiment_{file_type}.png']))
+            
+            # Create all three versions of the timeline charts
+            timeline_args = (file_type, period, base_dir)
+            for subfolder, kwargs in [('timeline_with_neutral', {'include_neutral': True}),
+                                      ('timeline_without_neutral', {'include_neutral': False}),
+                                      ('timeline_percentage', {'include_neutral': False, 'as_percentage': True})]:
+                jobs.append(make_job('plot_sentiment_over_time', file_type, period, 'frame', timeline_args,
+                                     [f'{base_dir}/{subfolder}/sentiment_timeline_{file_type}_{period}.png'],
+                                     kwargs))
+            
+            # Period-specific visualizations
+            if period == 'hour':
+                jobs.append(make_job('plot_hourly_patterns', file_type, period, 'frame', frame_args,
+                                     [f'{base_dir}/patterns/hourly_sentiment_{file_type}.png']))
+            elif period == 'weekday':
+                jobs.append(make_job('plot_weekday_patterns', file_type, period, 'frame', frame_args,
+                                     [f'{base_dir}/patterns/weekday_sentiment_{file_type}.png']))
+    
+    # Create weekly heatmaps, one job per file type
+    for file_type in file_types:
+        jobs.append(make_job('plot_weekly_heatmap', file_type, 'day_hour', None, ([file_type], base_dir),
+                             [f'{base_dir}/patterns/weekly_heatmap_{file_type}_{version}.png'
+                              for version in ['adjusted', 'fixed']],
+                             {'source': source, 'directory': directory}))
+    return jobs
+
+def job_fingerprint(job, sources):
+    """Hash of the job's input data slice, plot code and parameters"""
+    if job['source'] not in sources:
+        try:
+            sources[job['source']] = load_results(job['file_type'], job['period'], job['format'], job['directory'])
+        except FileNotFoundError:
+            sources[job['source']] = None
+    data = sources[job['source']]
+    if data is None:
+        return None
+    
+    digest = hashlib.sha256()
+    # Store columns are numpy arrays, they hash as the lists they hold
+    digest.update(json.dumps(data[job['slice']], sort_keys=True, default=np.ndarray.tolist).encode('utf-8'))
+    functions = [globals()[job['plot']]]
+    if job['inputs'] == 'frame':
+        functions.append(create_time_series_df)
+    for function in functions:
+        digest.update(inspect.getsource(function).encode('utf-8'))
+    digest.update(repr((job['args'], sorted(job['kwargs'].items()))).encode('utf-8'))
+    digest.update(f"matplotlib {matplotlib.__version__} seaborn {sns.__version__}".encode('utf-8'))
+    return digest.hexdigest()
+
+def group_fingerprint(group, sources):
+    fingerprints = [job_fingerprint(job, sources) for job in group]
+    if None in fingerprints:
+        return None
+    return hashlib.sha256('\n'.join(fingerprints).encode('utf-8')).hexdigest()
+
+def load_manifest(path):
+    try:
+        return load_json_file(path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(path, manifest):
+    ensure_dir(os.path.dirname(path))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def is_up_to_date(entry, fingerprint, outputs):
+    if entry is None or fingerprint is None or entry['hash'] != fingerprint:
+        return False
+    # Plots that skip their period on purpose never produce an output
+    return not entry['drawn'] or all(os.path.exists(path) for path in outputs)
+
+def run_plot_job(job):
+    plot = globals()[job['plot']]
+    args = list(job['args'])
+    if job['inputs']:
+        with tracer.stage('load_data', source=job['source']):
+            data = load_results(job['file_type'], job['period'], job['format'], job['directory'])
+            args.insert(0, data if job['inputs'] == 'data' else create_time_series_df(data))
+    with tracer.stage('plot', job=job['name']):
+        plot(*args, **job['kwargs'])
+
+def output_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def run_plot_group(group, trace=False):
+    """Render jobs that share output files, the last job to write them wins as it did in series.
+    Returns the job results and, in a traced worker process, the trace events for the parent."""
+    if trace:
+        tracer.enable()
+        tracer.patch(plt, 'savefig')
+    first_event = len(tracer.events)  # A forked worker starts with a copy of the parent's events
+    results = []
+    for job in reversed(group):
+        before = [output_mtime(path) for path in job['outputs']]
+        started = time.perf_counter()
+        error = None
+        try:
+            run_plot_job(job)
+        except FileNotFoundError as e:
+            error = f"File not found: {e.filename}"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            plt.close('all')
+        
+        written = [output_mtime(path) for path in job['outputs']] != before
+        results.append({
+            'name': job['name'],
+            'seconds': time.perf_counter() - started,
+            'written': written,
+            'error': error
+        })
+        # Earlier jobs in the group would only be overwritten
+        if written:
+            break
+    return results, tracer.drain(first_event) if trace else []
+
+def render_plots(jobs, workers=1, manifest_path=None, force=False):
+    """Render plot jobs in a process pool, a failing job does not stop the others.
+    With a manifest, figures whose data slice, code and parameters are unchanged are skipped."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(tuple(job['outputs']), []).append(job)
+    
+    manifest = load_manifest(manifest_path) if manifest_path else {}
+    sources = {}
+    pending = []
+    with tracer.stage('fingerprint', figures=len(groups)):
+        for outputs, group in groups.items():
+            key = '|'.join(outputs)
+            fingerprint = group_fingerprint(group, sources)
+            if force or not is_up_to_date(manifest.get(key), fingerprint, outputs):
+                pending.append((key, fingerprint, group))
+    unchanged = len(groups) - len(pending)
+    
+    started = time.perf_counter()
+    group_results = []
+    with tracer.stage('render', figures=len(pending), workers=workers):
+        if workers <= 1 or len(pending) <= 1:
+            if tracer.enabled:
+                tracer.patch(plt, 'savefig')
+            for key, fingerprint, group in pending:
+                group_results.append((key, fingerprint, run_plot_group(group)[0]))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run_plot_group, group, tracer.enabled): (key, fingerprint)
+                           for key, fingerprint, group in pending}
+                for future in as_completed(futures):
+                    group_result, events = future.result()
+                    tracer.merge(events)
+                    group_results.append((*futures[future], group_result))
+    wall = time.perf_counter() - started
+    
+    results = []
+    for key, fingerprint, group_result in group_results:
+        results.extend(group_result)
+        # Only record groups that rendered cleanly, failures are retried next run
+        if fingerprint is not None and not any(result['error'] for result in group_result):
+            manifest[key] = {'hash': fingerprint, 'drawn': group_result[-1]['written']}
+        else:
+            manifest.pop(key, None)
+    if manifest_path and group_results:
+        save_manifest(manifest_path, manifest)
+    
+    # Per-plot timings, slowest first
+    if results:
+        print(f"\n{'Seconds':>8}  Plot")
+    for result in sorted(results, key=lambda result: result['seconds'], reverse=True):
+        status = f"  FAILED: {result['error']}" if result['error'] else ("" if result['written'] else "  (nothing drawn)")
+        print(f"{result['seconds']:8.2f}  {result['name']}{status}")
+    
+    failed = [result for result in results if result['error']]
+    print(f"\nRendered {len(results) - len(failed)} plot jobs in {wall:.1f}s wall "
+          f"({sum(result['seconds'] for result in results):.1f}s total plot time, {workers} workers), "
+          f"{unchanged} of {len(groups)} figures unchanged, {len(failed)} failed")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the sentiment graphs')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Rendering processes, 0 uses every core, 1 renders in this process')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-render every figure even if its inputs and code are unchanged')
+    parser.add_argument('--input', choices=['json', 'store'], default='json',
+                        help='Read the per-period JSON files or the columnar sentiment store')
+    add_trace_arguments(parser)
+    args = parser.parse_args(argv)
+    start_tracing(args)
+    
     # Create output directories
     base_dir = 'graphs'
     subdirs = ['distribution', 'patterns', 'correlation', 'momentum',
@@ -340,43 +630,9 @@ def main():
     file_types = ['dm_messages', 'guild_messages', 'all_messages']
     periods = ['day', 'month', 'weekday', 'hour']
 
-    for file_type in file_types:
-        print(f"\nProcessing visualizations for {file_type}...")
-        
-        # Generate distribution plot only once per file_type using day period
-        try:
-            data = load_json_file(f'data/sentiment/{file_type}_sentiment_day.json')
-            plot_sentiment_distribution(data, "Overall", file_type, base_dir)
-        except FileNotFoundError:
-            print(f"File not found: data/sentiment/{file_type}_sentiment_day.json")
-        
-        # Continue with other visualizations for all periods
-        for period in periods:
-            try:
-                data = load_json_file(f'data/sentiment/{file_type}_sentiment_{period}.json')
-                df = create_time_series_df(data)
-                
-                # Generate visualizations
-                plot_sentiment_correlation(df, file_type, base_dir)
-                plot_sentiment_momentum(df, file_type, base_dir)
-                plot_sentiment_volatility(df, file_type, base_dir)
-                plot_volume_sentiment_relationship(df, file_type, base_dir)
-                # Create all three versions of the timeline charts
-                plot_sentiment_over_time(df, file_type, period, base_dir, include_neutral=True)
-                plot_sentiment_over_time(df, file_type, period, base_dir, include_neutral=False)
-                plot_sentiment_over_time(df, file_type, period, base_dir, include_neutral=False, as_percentage=True)
-                
-                # Period-specific visualizations
-                if period == 'hour':
-                    plot_hourly_patterns(df, file_type, base_dir)
-                elif period == 'weekday':
-                    plot_weekday_patterns(df, file_type, base_dir)
-
-            except FileNotFoundError:
-                print(f"File not found: data/sentiment/{file_type}_sentiment_{period}.json")
-
-    # Create weekly heatmaps
-    plot_weekly_heatmap(file_types, base_dir)
+    jobs = build_plot_jobs(file_types, periods, base_dir, args.input)
+    render_plots(jobs, args.workers or os.cpu_count(), MANIFEST_PATH, args.force)
+    finish_tracing(args)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file